@@ -2,6 +2,7 @@ import  argparse
 import pkgutil
 #import time
 import requests
+import signal
 import sys
 
 import ingestorservices
@@ -56,8 +57,14 @@ if __name__ == '__main__':
         plugin.initialise( **args.kwargs )
         plugin.start()
 
-    for name, plugin in host_services.plugins.items():
-        plugin.join()
+    # rolling restarts send SIGTERM, drain as for ctrl-c
+    signal.signal( signal.SIGTERM, signal.default_int_handler )
+
+    try:
+        for name, plugin in host_services.plugins.items():
+            plugin.join()
+    except KeyboardInterrupt:
+        host_services.shutdown()
 
 
 
@@ -0,0 +1,89 @@
+import  argparse
+import json
+import random
+import sqlite3
+import time
+
+from ingestorservices import Property, _and_, _or_, _where_, compile_predicate, compile_sql
+from ingestorservices._filters import sql_regexp
+
+
+def make_records( n, seed=0 ):
+    rnd = random.Random( seed )
+
+    return [ { 'pid' : 'pid%07d' % i,
+               'owner' : 'owner%d' % rnd.randrange( 20 ),
+               'size' : rnd.randrange( 1 << 30 ),
+               'creationTime' : '2024-%02d-%02dT12:00:00Z' % ( rnd.randrange( 1, 13 ), rnd.randrange( 1, 29 ) ),
+               'scientificMetadata' : { 'step' : rnd.randrange( 1, 3 ), 'run' : 'run%d' % rnd.randrange( 100 )
+                                        , 'tags' : rnd.choice( [ None, 'tag%d' % rnd.randrange( 10 )
+                                                                 , [ 'tag%d' % rnd.randrange( 10 ) for _ in range( rnd.randrange( 4 ) ) ] ] ) } }
+             for i in range( n ) ]
+
+
+def timed( label, fn ):
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+
+    print( '%-28s %8.3f s %9d matches' % (label, seconds, len( result )) )
+
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                            prog='FilterBenchmark',
+                            description='Filters records locally with where filters compiled by ingestorservices')
+
+    parser.add_argument('--records', type=int, default=1000000)
+
+    args = parser.parse_args()
+
+    step = Property( 'scientificMetadata.step' )
+    owner = Property( 'owner' )
+    created = Property( 'creationTime' )
+    size = Property( 'size' )
+
+    where = _where_( step.eq( 1 )
+                    , _or_( owner.inq( 'owner1', 'owner2', 'owner3' ), owner.like( '^owner1[0-9]$' ) )
+                    , _and_( created.gte( '2024-03-01' ), created.lt( '2024-07-01' ) )
+                    , size.gt( 1 << 28 ) )
+
+    print( json.dumps( where ) )
+
+    records = timed( 'generate', lambda: make_records( args.records ) )
+
+    predicate = compile_predicate( where )
+    matches = timed( 'compiled predicate', lambda: [ r for r in records if predicate( r ) ] )
+
+    db = sqlite3.connect( ':memory:' )
+    db.create_function( 'REGEXP', 2, sql_regexp, deterministic=True )
+    db.execute( 'CREATE TABLE records (pid TEXT PRIMARY KEY, owner TEXT, size INTEGER, creationTime TEXT, scientificMetadata TEXT)' )
+    db.executemany( 'INSERT INTO records VALUES (?, ?, ?, ?, ?)'
+                    , ( (r['pid'], r['owner'], r['size'], r['creationTime'], json.dumps( r['scientificMetadata'] )) for r in records ) )
+    db.execute( 'CREATE INDEX records_creationTime ON records (creationTime)' )
+
+    def column( field ):
+        if field.startswith( 'scientificMetadata.' ):
+            return "json_extract(scientificMetadata, '$.%s')" % field.split( '.', 1 )[1]
+        return field
+
+    sql, params = compile_sql( where, column=column )
+    rows = timed( 'compiled sql', lambda: db.execute( 'SELECT pid FROM records WHERE ' + sql, params ).fetchall() )
+
+    assert sorted( r['pid'] for r in matches ) == sorted( pid for pid, in rows )
+
+    # a list field matches when any element does, a plain value as it is
+    tags = Property( 'scientificMetadata.tags' )
+
+    for where in ( tags.eq( 'tag1' ), tags.inq( 'tag2', 'tag3' ), tags.ne( 'tag4' ), { tags.name : { 'nin' : [ 'tag5', 'tag6' ] } } ):
+        print( json.dumps( where ) )
+
+        predicate = compile_predicate( where )
+        matches = timed( 'compiled predicate', lambda: [ r for r in records if predicate( r ) ] )
+
+        sql, params = compile_sql( where, column=column )
+        rows = timed( 'compiled sql', lambda: db.execute( 'SELECT pid FROM records WHERE ' + sql, params ).fetchall() )
+
+        assert sorted( r['pid'] for r in matches ) == sorted( pid for pid, in rows )
@@ -255,7 +255,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     @log_decorator
     def closeEvent( self, *args, **kwargs ):
-        self.host_services.stop_plugins()
+        self.host_services.shutdown( timeout=10 )
                 
     @log_decorator
     def setupUI(self):
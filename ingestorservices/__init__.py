@@ -1,21 +1,32 @@
 import collections
+import hashlib
 import importlib
 import pkgutil
 import datetime
 import json
+import os
+import pathlib
+import time
+import weakref
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-from . _filters import Property, _and_, _or_, _where_
+from . _filters import Property, Query, _and_, _or_, _where_, compile_predicate, compile_sql, compile_mongo, facet_counts
 from . client import MyMetadataClient
+from . _mirror import DatasetMirror
+from . _watch import DatasetWatch
+from . _tokens import TokenCache
 
 from . import core
 from . import plugin
 from . import properties
+from . import upload
+from . import watcher
 
 from . _dialogs import _property_2_layout, _property_group_2_layout
 
@@ -63,23 +74,63 @@ class HostServices:
             del plugins[ identifier ] 
 
 
-    def __init__( self ):
+    def __init__( self, state_path=None, max_in_flight=4 ):
         super().__init__()
 
+        # on disk state such as durable work queues
+        self.state_path = pathlib.Path( state_path or os.environ.get( 'INGESTOR_STATE', '~/.ingestorservices' ) ).expanduser()
+
         self.bridge = HostServices.Bridge()
 
         self._scicat = None
 
         self._pluginRegistry = PluginRegistry(self)
 
-    def login( self, base_url, username, password):
+        # shared by all plugins that watch spool directories
+        self.watcher = watcher.FileWatcher()
+
+        # event loop for AsyncPluginBase plugins, started by the first one
+        self.loop = plugin.HostLoop()
+
+        # retries, circuit breakers and the outbox for datasets saved while SciCat is down
+        self.uploader = upload.Uploader( upload.Outbox( self.state_dir( 'outbox' ) / 'outbox.sqlite' ), lambda: self._scicat )
+        self.uploader.sigSent.connect( self.onOutboxSent )
+
+        # all plugins' uploads, max_in_flight at a time per server and taking turns between plugins
+        self.uploads = upload.UploadExecutor( max_in_flight=max_in_flight )
+
+        # local copies of the catalog per (server, user), off until enable_mirror
+        self._mirrors = {}
+        self._mirror_max_age = None
+
+        # open watches, stopped on shutdown
+        self._watches = weakref.WeakSet()
+
+    def state_dir( self, *parts ):
+        path = self.state_path.joinpath( *parts )
+        path.mkdir( parents=True, exist_ok=True )
+        return path
+
+    def login( self, base_url, username, password, compression=None, check_references='warn'):
 
         # Create a client object. The account used should have the ingestor role in SciCat
         self.log( 'LOGIN %s %s' %( base_url, username) )
 
+        # plugins share the one client, and processes share its token through the cache
+        scicat = self._scicat
+        if scicat is not None and scicat._base_url.rstrip('/') == base_url.rstrip('/') and scicat._username == username:
+            return 0
+
         self._scicat = MyMetadataClient(base_url=base_url,
                 username=username,
-                password=password)
+                password=password,
+                token_cache=TokenCache( self.state_dir( 'tokens' ) ),
+                compression=compression,
+                check_references=check_references)
+
+        # send anything left in the outbox by an earlier run
+        if len( self.uploader.outbox ):
+            self.uploader.wake()
 
         return 1 if self._scicat == None else 0
 
@@ -110,33 +161,164 @@ class HostServices:
             except Exception as e:
                 print(e)
 
+    def enable_mirror( self, max_age=60.0 ):
+        '''Answer requestDatasetFind from a local copy of the catalog, synced when older than max_age seconds'''
+
+        self._mirror_max_age = max_age
+
+    def _mirror( self ):
+        scicat = self._scicat
+
+        if self._mirror_max_age is None or scicat is None:
+            return None
+
+        key = ( scicat._base_url, scicat._username )
+        mirror = self._mirrors.get( key )
+
+        if mirror is None:
+            name = hashlib.sha1( ('%s|%s' % key).encode() ).hexdigest()[:16]
+            mirror = self._mirrors[ key ] = DatasetMirror( self.state_dir( 'mirror' ) / ('%s.sqlite' % name), scicat )
+
+        mirror.client = scicat
+        mirror.max_age = self._mirror_max_age
+
+        return mirror
+
     @log_decorator
     def requestDatasetFind( self, filter_fields ):
         scicat = self._scicat
 
         try:
+            mirror = self._mirror()
+            if mirror is not None:
+                results = mirror.find( filter_fields )
+                if results is not None:
+                    return results
+
+            if isinstance( filter_fields, Query ):
+                return scicat.find( 'Datasets', filter_fields )
+
             results = scicat.datasets_get_many( filter_fields=filter_fields )
             return results
         except Exception as e:
             print(e)
 
+    @log_decorator
+    def requestDatasetCount( self, filter_fields=None ):
+        '''Number of datasets matching a where filter or Query, without fetching them'''
+
+        try:
+            mirror = self._mirror()
+            if mirror is not None:
+                mirror.refresh()
+                count = mirror.count( filter_fields )
+                if count is not None:
+                    return count
+
+            return self._scicat.count( 'Datasets', filter_fields )
+        except Exception as e:
+            self.log( 'Dataset count failed : %s' % e )
 
     @log_decorator
-    def requestDatasetSave(self, ds):
+    def requestDatasetFacets( self, facets, filter_fields=None ):
+        '''{ facet : { value : count } } of datasets matching a where filter or Query, e.g. facets=['owner']'''
+
+        try:
+            mirror = self._mirror()
+            if mirror is not None:
+                mirror.refresh()
+                counts = mirror.facets( facets, filter_fields )
+                if counts is not None:
+                    return counts
+
+            return self._scicat.facets( 'Datasets', facets, filter_fields )
+        except Exception as e:
+            self.log( 'Dataset facets failed : %s' % e )
+
+
+    def watch( self, filter_fields, since=None, interval=1.0, max_interval=30.0, timeout=None ):
+        '''Iterator over datasets matching a where filter or Query as they appear, polling for updatedAt deltas.'''
+        '''Ends after timeout seconds, on stop() or on shutdown. See DatasetWatch'''
+
+        w = DatasetWatch( lambda: self._scicat, filter_fields, since=since
+                          , interval=interval, max_interval=max_interval, timeout=timeout )
+
+        self._watches.add( w )
+
+        return w
+
+    def _server( self ):
         scicat = self._scicat
+        return scicat._base_url if scicat is not None else None
+
+    @log_decorator
+    def requestDatasetSave(self, ds, key=None, owner=None):
+        '''Future of the pid of the saved dataset, or of None. If SciCat is unreachable the dataset is held in'''
+        '''the outbox under key and uploaded when it recovers, saving the same key again then returns its pid.'''
+        '''owner identifies the plugin for fair scheduling, by default the calling thread'''
+
+        return self.uploads.submit( self._server(), owner, self._saveDataset, self._scicat, ds, key )
+
+    def _saveDataset(self, scicat, ds, key):
         dataset_id = None
 
         try:
-            dataset_id = scicat.upload_new_dataset( ds )
+            dataset_id = self.uploader.save_dataset( scicat, ds, key or upload.dataset_key( ds ) )
 
             self.log( 'Ingested : %s' % dataset_id )
 
+        except upload.UploadDeferred as e:
+            self.log( '%s : Deferred ingest : %s' % (self, str(e)) )
+
         except Exception as e:
             self.log( '%s : Failed to ingest : EXCEPTION %s' % (self, str(e)) )
 
 
         return dataset_id
 
+    @log_decorator
+    def requestDatablockSave(self, dataset_id, datablock, owner=None, key=None):
+        '''Future of the id of the saved datablock, or of None.'''
+        '''A datablock saved before under the same key is not saved again, its id is returned'''
+
+        return self.uploads.submit( self._server(), owner, self._saveDatablock, self._scicat, dataset_id, datablock, key )
+
+    def _saveDatablock(self, scicat, dataset_id, datablock, key=None):
+        datablock_id = None
+
+        try:
+            datablock_id = self.uploader.save_datablock( scicat, dataset_id, datablock, key )
+
+            self.log( 'Datablock : %s' % datablock_id )
+
+        except Exception as e:
+            self.log( '%s : Failed to save datablock : EXCEPTION %s' % (self, str(e)) )
+
+        return datablock_id
+
+    @log_decorator
+    def requestAttachmentSave(self, attachment, owner=None):
+        '''Future of the id of the saved attachment, or of None'''
+
+        return self.uploads.submit( self._server(), owner, self._saveAttachment, self._scicat, attachment )
+
+    def _saveAttachment(self, scicat, attachment):
+        attachment_id = None
+
+        try:
+            res = self.uploader.call( scicat._base_url, scicat.upload_attachment, attachment )
+            attachment_id = res.get('id') if res else None
+
+            self.log( 'Attached : %s' % attachment_id )
+
+        except Exception as e:
+            self.log( '%s : Failed to attach : EXCEPTION %s' % (self, str(e)) )
+
+        return attachment_id
+
+    def onOutboxSent(self, key, pid):
+        self.log( 'Ingested from outbox : %s %s' % (key, pid) )
+
     def log(self, s, *args):
 
         now = datetime.datetime.now()
@@ -158,7 +340,49 @@ class HostServices:
         for name, plugin in self.plugins.items():
             plugin.stop()
 
+        for w in list( self._watches ):
+            w.stop()
+
+        self.watcher.stop()
+        self.uploads.shutdown( wait=False )
+        self.uploader.stop()
+        self.loop.stop()
+
+    @log_decorator
+    def shutdown( self, timeout=30.0 ):
+        '''Stop intake, give plugins up to timeout seconds to finish queued work, then stop everything.'''
+        '''Unfinished work stays in the plugins' durable queues and the outbox for the next start.'''
+        '''Returns { plugin name : report }, with the outbox size under 'outbox' '''
+
+        deadline = time.monotonic() + timeout
+
+        # no new files
+        self.watcher.stop()
+
+        for w in list( self._watches ):
+            w.stop()
+
+        report = {}
+
+        def drain( plugin ):
+            try:
+                return plugin.drain( deadline )
+            except Exception as e:
+                return { 'error' : str(e) }
+
+        # plugins drain side by side against the one deadline
+        if self.plugins:
+            with ThreadPoolExecutor( max_workers=len( self.plugins ) ) as executor:
+                for name, res in zip( self.plugins.keys(), executor.map( drain, self.plugins.values() ) ):
+                    report[ name ] = res
+                    self.log( 'Shutdown %s : %s' % (name, res) )
 
+        self.uploads.shutdown( timeout=max( 0, deadline - time.monotonic() ) )
+        self.uploader.stop()
+        self.loop.stop()
 
+        report[ 'outbox' ] = len( self.uploader.outbox )
+        self.log( 'Shutdown outbox : %d datasets waiting' % report[ 'outbox' ] )
 
+        return report
 
@@ -1,3 +1,11 @@
+import collections
+import functools
+import json
+import operator
+import re
+import urllib.parse
+
+
 class Property:
     def __init__(self, name):
         self.name = name
@@ -39,9 +47,651 @@ def _where_( *args ):
 
     w = {}
     for arg in args:
-        w.update( arg )
+        for key, value in arg.items():
+            if key not in w:
+                w[ key ] = value
+
+            elif key == 'and':
+                w[ 'and' ] = w[ 'and' ] + list( value )
+
+            else:
+                # a second condition on the same key is kept alongside the first, not written over it
+                w[ 'and' ] = w.get( 'and', [] ) + [ { key : value } ]
 
     return {'where' : w}
 
 
 
+
+
+# inq values per request when a Query is split, keeping URLs within common server limits
+MAX_INQ = 100
+
+
+def _find_inq( node, max_inq, path=() ):
+    '''Path to the first inq list in a where filter with more than max_inq values, or None'''
+
+    if isinstance( node, list ):
+        items = enumerate( node )
+    elif isinstance( node, dict ):
+        items = node.items()
+    else:
+        return None
+
+    for key, value in items:
+        if key == 'inq' and isinstance( value, list ) and len( value ) > max_inq:
+            return path + ( key, )
+
+        found = _find_inq( value, max_inq, path + ( key, ) )
+        if found is not None:
+            return found
+
+    return None
+
+
+def _dedup_inq( node ):
+    '''Drop repeated values from every inq list in a where filter, in place'''
+
+    if isinstance( node, list ):
+        for value in node:
+            _dedup_inq( value )
+
+    elif isinstance( node, dict ):
+        for key, value in node.items():
+            if key == 'inq' and isinstance( value, list ):
+                try:
+                    node[ key ] = list( dict.fromkeys( value ) )
+                except TypeError:
+                    pass
+            else:
+                _dedup_inq( value )
+
+
+def _order_key( value ):
+    # None sorts first, as does a missing field
+    return ( value is not None, value )
+
+
+class Query:
+    '''Immutable loopback filter: where conditions, fields, order, limit and skip.'''
+    '''Methods return new queries. The JSON and URL encoded forms and the local predicate are made once.'''
+    '''chunks splits inq lists longer than max_inq into queries whose results, merged, are those of the whole'''
+
+    def __init__(self, *conditions, fields=None, order=None, limit=None, skip=None):
+        f = {}
+
+        if conditions:
+            f.update( _where_( *conditions ) )
+        if fields:
+            f[ 'fields' ] = { name : True for name in fields }
+        if order:
+            f[ 'order' ] = list( order )
+        if limit is not None:
+            f[ 'limit' ] = limit
+        if skip is not None:
+            f[ 'skip' ] = skip
+
+        self._from_filter( f )
+
+    def _from_filter(self, f):
+        # only the JSON is kept, so nothing outside can change the query
+        self._json = json.dumps( f )
+
+    @classmethod
+    def from_filter(cls, f):
+        query = cls.__new__( cls )
+        query._from_filter( f )
+        return query
+
+    @classmethod
+    def of(cls, f):
+        '''A Query from a Query, a whole filter or a where filter'''
+
+        if isinstance( f, Query ):
+            return f
+
+        if not f:
+            return cls.from_filter( {} )
+
+        if 'where' in f and set( f ) <= _FILTER_KEYS:
+            return cls.from_filter( f )
+
+        return cls.from_filter( { 'where' : f } )
+
+    def _replace(self, **changes):
+        f = self.filter
+        f.update( changes )
+        return Query.from_filter( { k : v for k, v in f.items() if v is not None } )
+
+    @property
+    def filter(self):
+        '''The filter as a new dict'''
+        return json.loads( self._json )
+
+    @property
+    def json(self):
+        return self._json
+
+    @functools.cached_property
+    def encoded(self):
+        '''URL encoded, for ?filter='''
+        return urllib.parse.quote( self._json )
+
+    @functools.cached_property
+    def predicate(self):
+        return compile_predicate( self )
+
+    def sql(self, column=None):
+        return compile_sql( self, column )
+
+    def where(self, *conditions):
+        '''This query with conditions added'''
+
+        f = self.filter
+        w = _where_( f.get( 'where', {} ), *conditions )[ 'where' ]
+        return self._replace( where=w )
+
+    def fields(self, *names):
+        return self._replace( fields={ name : True for name in names } or None )
+
+    def order(self, *specs):
+        return self._replace( order=list( specs ) or None )
+
+    def limit(self, n):
+        return self._replace( limit=n )
+
+    def skip(self, n):
+        return self._replace( skip=n )
+
+    def chunks(self, max_inq=MAX_INQ):
+        '''Queries with no inq list longer than max_inq, together covering this one. A record may match more'''
+        '''than one of them, e.g. through a list field, merge drops the duplicates'''
+
+        f = self.filter
+        _dedup_inq( f.get( 'where', {} ) )
+
+        path = _find_inq( f.get( 'where', {} ), max_inq )
+
+        if path is None:
+            return [ self ]
+
+        if f.get( 'skip' ):
+            raise ValueError( 'A query with skip cannot be split' )
+
+        *parents, last = ( 'where', ) + path
+
+        parent = f
+        for key in parents:
+            parent = parent[ key ]
+
+        values = parent[ last ]
+
+        queries = []
+        for i in range( 0, len( values ), max_inq ):
+            parent[ last ] = values[ i : i + max_inq ]
+            queries.extend( Query.from_filter( f ).chunks( max_inq ) )
+
+        return queries
+
+    def merge(self, results, key='pid'):
+        '''One result from the results of chunks, in order and within limit. Records are told apart by their key field,'''
+        '''those with the same key are duplicates and dropped. Records without it are all kept, equal content does not'''
+        '''make two records the same, so the key has to be among the fields of a query that is split'''
+
+        f = self.filter
+        merged = []
+        seen = set()
+
+        for records in results:
+            for record in records or []:
+                k = record.get( key )
+
+                if k is None:
+                    merged.append( record )
+
+                elif k not in seen:
+                    seen.add( k )
+                    merged.append( record )
+
+        self._sort( merged )
+
+        if f.get( 'limit' ) is not None:
+            merged = merged[ : f[ 'limit' ] ]
+
+        return merged
+
+    def select(self, records):
+        '''records as the server answers this query: in order, from skip, within limit and with only its fields'''
+
+        f = self.filter
+        records = self._sort( list( records ) )
+
+        skip = f.get( 'skip' ) or 0
+        limit = f.get( 'limit' )
+        records = records[ skip : None if limit is None else skip + limit ]
+
+        if f.get( 'fields' ):
+            records = [ _project( record, f[ 'fields' ] ) for record in records ]
+
+        return records
+
+    def _sort(self, records):
+        order = self.filter.get( 'order' )
+        if isinstance( order, str ):
+            order = [ order ]
+
+        for spec in reversed( order or [] ):
+            name, _, direction = spec.partition( ' ' )
+            get = _getter( name )
+            records.sort( key=lambda r: _order_key( None if get( r ) is _MISSING else get( r ) )
+                          , reverse=direction.strip().upper() == 'DESC' )
+
+        return records
+
+    def __eq__(self, other):
+        return isinstance( other, Query ) and other._json == self._json
+
+    def __hash__(self):
+        return hash( self._json )
+
+    def __repr__(self):
+        return 'Query(%s)' % self._json
+
+
+# Local evaluation of loopback where filters, as built above, against dataset dicts (compile_predicate)
+# or a SQLite table (compile_sql). like, ilike and regexp are regular expressions as on the server
+
+_MISSING = object()
+
+_FILTER_KEYS = { 'where', 'fields', 'order', 'limit', 'skip', 'include' }
+
+_SQL_COMPARE = { 'gt' : '>', 'gte' : '>=', 'lt' : '<', 'lte' : '<=' }
+
+
+def _unwrap( where ):
+    if isinstance( where, Query ):
+        return where.filter.get( 'where', {} )
+
+    # a whole filter, as from _where_ or with fields, order etc.
+    if isinstance( where, dict ) and 'where' in where and set( where ) <= _FILTER_KEYS:
+        return where[ 'where' ]
+    return where or {}
+
+
+def _getter( field ):
+    parts = field.split( '.' )
+
+    if len( parts ) == 1:
+        return lambda record: record.get( field, _MISSING )
+
+    def get( record ):
+        for part in parts:
+            if not isinstance( record, dict ):
+                return _MISSING
+            record = record.get( part, _MISSING )
+        return record
+
+    return get
+
+
+def _project( record, fields ):
+    '''record with only the fields named true, dotted names reaching into objects, or without those named false'''
+
+    if not isinstance( fields, dict ):
+        fields = { name : True for name in fields }
+
+    include = [ name for name, on in fields.items() if on ]
+
+    if not include:
+        return { k : v for k, v in record.items() if fields.get( k, True ) }
+
+    out = {}
+
+    for name in include:
+        value = _getter( name )( record )
+        if value is _MISSING:
+            continue
+
+        *parents, last = name.split( '.' )
+
+        node = out
+        for part in parents:
+            node = node.setdefault( part, {} )
+
+        node[ last ] = value
+
+    return out
+
+
+def _pattern( value, op, options=None ):
+    flags = re.IGNORECASE if op in ('ilike', 'nilike') or 'i' in (options or '') else 0
+
+    if isinstance( value, re.Pattern ):
+        return re.compile( value.pattern, value.flags | flags )
+
+    return re.compile( value, flags )
+
+
+def _compare( op, value ):
+    compare = { 'gt' : operator.gt, 'gte' : operator.ge, 'lt' : operator.lt, 'lte' : operator.le }[ op ]
+
+    def test( v ):
+        try:
+            return v is not _MISSING and v is not None and compare( v, value )
+        except TypeError:
+            return False
+
+    return test
+
+
+def _between( low, high ):
+    def test( v ):
+        try:
+            return v is not _MISSING and v is not None and low <= v <= high
+        except TypeError:
+            return False
+
+    return test
+
+
+def _test( op, value, options=None ):
+    '''Function of a field value for one operator'''
+
+    # as on the server, a list field matches when any of its elements does
+    if op == 'eq':
+        if value is None:
+            return lambda v: v is _MISSING or v is None
+        return lambda v: v == value or ( isinstance( v, list ) and value in v )
+
+    if op in ('ne', 'neq'):
+        eq = _test( 'eq', value )
+        return lambda v: not eq( v )
+
+    if op in _SQL_COMPARE:
+        return _compare( op, value )
+
+    if op == 'between':
+        return _between( *value )
+
+    if op in ('inq', 'nin'):
+        try:
+            values = frozenset( value )
+        except TypeError:
+            values = value
+
+        def contains( v ):
+            if isinstance( v, list ):
+                return any( x in values for x in v if not isinstance( x, (dict, list) ) )
+            return v in values
+
+        if op == 'inq':
+            return lambda v: v is not _MISSING and contains( v )
+
+        return lambda v: v is _MISSING or not contains( v )
+
+    if op in ('like', 'ilike', 'regexp'):
+        search = _pattern( value, op, options ).search
+        return lambda v: isinstance( v, str ) and search( v ) is not None
+
+    if op in ('nlike', 'nilike'):
+        search = _pattern( value, op, options ).search
+        return lambda v: not ( isinstance( v, str ) and search( v ) is not None )
+
+    if op == 'exists':
+        return ( lambda v: v is not _MISSING ) if value else ( lambda v: v is _MISSING )
+
+    raise ValueError( 'Unsupported filter operator %s' % op )
+
+
+def _all( predicates ):
+    '''One predicate for several, chained in pairs as generator expressions cost more per record'''
+
+    if not predicates:
+        return lambda record: True
+
+    predicate = predicates[-1]
+
+    for first in reversed( predicates[:-1] ):
+        predicate = ( lambda first, second: lambda record: first( record ) and second( record ) )( first, predicate )
+
+    return predicate
+
+
+def _any( predicates ):
+    if not predicates:
+        return lambda record: False
+
+    predicate = predicates[-1]
+
+    for first in reversed( predicates[:-1] ):
+        predicate = ( lambda first, second: lambda record: first( record ) or second( record ) )( first, predicate )
+
+    return predicate
+
+
+def _field_predicate( field, condition ):
+    get = _getter( field )
+
+    if isinstance( condition, dict ) and condition and all( isinstance( k, str ) for k in condition ):
+        options = condition.get( 'options' )
+        tests = [ _test( op, value, options ) for op, value in condition.items() if op != 'options' ]
+
+        if len( tests ) == 1:
+            test = tests[0]
+            return lambda record: test( get( record ) )
+
+        return _all( [ ( lambda test: lambda record: test( get( record ) ) )( test ) for test in tests ] )
+
+    test = _test( 'eq', condition )
+    return lambda record: test( get( record ) )
+
+
+def compile_predicate( where ):
+    '''Function of a record (dict) that is True when it matches the where filter, e.g. from _where_'''
+
+    where = _unwrap( where )
+    predicates = []
+
+    for key, condition in where.items():
+        if key in ('and', 'or'):
+            parts = [ compile_predicate( c ) for c in condition ]
+            predicates.append( _all( parts ) if key == 'and' else _any( parts ) )
+        else:
+            predicates.append( _field_predicate( key, condition ) )
+
+    return _all( predicates )
+
+
+def _sql_value( value ):
+    return int( value ) if isinstance( value, bool ) else value
+
+
+# a JSON value taken out of a column, which may be a list
+_SQL_JSON = re.compile( r"^json_extract\(([\w.]+), ('(?:[^']|'')*')\)$" )
+
+
+def _sql_list_test( column, source, path, op, value, params ):
+    # as in compile_predicate, a list matches eq and inq when any of its elements does
+    values = [ value ] if op in ('eq', 'ne', 'neq') else list( value )
+    if not values:
+        return '0' if op == 'inq' else '1'
+
+    marks = ', '.join( '?' * len( values ) )
+
+    params.extend( _sql_value( v ) for v in values )
+    params.extend( _sql_value( v ) for v in values )
+
+    match = ( "(%s IN (%s) OR EXISTS (SELECT 1 FROM json_each(%s, %s) WHERE json_type(%s, %s) = 'array' AND value IN (%s)))"
+              % (column, marks, source, path, source, path, marks) )
+
+    if op in ('eq', 'inq'):
+        return match
+    return '(%s IS NULL OR NOT %s)' % (column, match)
+
+
+def _sql_test( column, op, value, options, params ):
+    json_column = _SQL_JSON.match( column )
+
+    if json_column and op in ('eq', 'ne', 'neq', 'inq', 'nin') and value is not None:
+        return _sql_list_test( column, *json_column.groups(), op, value, params )
+
+    if op == 'eq':
+        if value is None:
+            return '%s IS NULL' % column
+        params.append( _sql_value( value ) )
+        return '%s = ?' % column
+
+    if op in ('ne', 'neq'):
+        if value is None:
+            return '%s IS NOT NULL' % column
+        params.append( _sql_value( value ) )
+        return '(%s IS NULL OR %s != ?)' % (column, column)
+
+    if op in _SQL_COMPARE:
+        params.append( _sql_value( value ) )
+        return '%s %s ?' % (column, _SQL_COMPARE[ op ])
+
+    if op == 'between':
+        params.extend( _sql_value( v ) for v in value )
+        return '%s BETWEEN ? AND ?' % column
+
+    if op in ('inq', 'nin'):
+        values = list( value )
+        if not values:
+            return '0' if op == 'inq' else '1'
+
+        params.extend( _sql_value( v ) for v in values )
+        marks = ', '.join( '?' * len( values ) )
+
+        if op == 'inq':
+            return '%s IN (%s)' % (column, marks)
+        return '(%s IS NULL OR %s NOT IN (%s))' % (column, column, marks)
+
+    if op in ('like', 'ilike', 'regexp', 'nlike', 'nilike'):
+        pattern = _pattern( value, op, options )
+        params.append( ('(?i)' if pattern.flags & re.IGNORECASE else '') + pattern.pattern )
+
+        if op in ('nlike', 'nilike'):
+            return '(%s IS NULL OR NOT %s REGEXP ?)' % (column, column)
+        return '%s REGEXP ?' % column
+
+    if op == 'exists':
+        return '%s IS %sNULL' % (column, 'NOT ' if value else '')
+
+    raise ValueError( 'Unsupported filter operator %s' % op )
+
+
+def sql_regexp( pattern, value ):
+    '''REGEXP for sqlite3 connections, connection.create_function( 'REGEXP', 2, sql_regexp )'''
+    return isinstance( value, str ) and re.search( pattern, value ) is not None
+
+
+def compile_sql( where, column=None ):
+    '''(sql, params) of a WHERE clause for the where filter. column maps a field name to its SQL'''
+    '''expression, by default the name itself. like, ilike and regexp need sql_regexp registered.'''
+    '''eq, ne, inq and nin on a json_extract( source, path ) expression also match the elements of a list'''
+
+    column = column or ( lambda field: field )
+
+    where = _unwrap( where )
+    params = []
+    clauses = []
+
+    for key, condition in where.items():
+        if key in ('and', 'or'):
+            parts = []
+            for c in condition:
+                sql, p = compile_sql( c, column )
+                parts.append( '(%s)' % sql )
+                params.extend( p )
+
+            if not parts:
+                clauses.append( '1' if key == 'and' else '0' )
+            else:
+                clauses.append( '(%s)' % ( ' AND ' if key == 'and' else ' OR ' ).join( parts ) )
+
+        elif isinstance( condition, dict ) and condition:
+            options = condition.get( 'options' )
+            for op, value in condition.items():
+                if op != 'options':
+                    clauses.append( _sql_test( column( key ), op, value, options, params ) )
+
+        else:
+            clauses.append( _sql_test( column( key ), 'eq', condition, None, params ) )
+
+    return ( ' AND '.join( clauses ) if clauses else '1' ), params
+
+
+_MONGO_OPS = { 'ne' : '$ne', 'neq' : '$ne', 'gt' : '$gt', 'gte' : '$gte', 'lt' : '$lt', 'lte' : '$lte'
+               , 'inq' : '$in', 'nin' : '$nin', 'exists' : '$exists' }
+
+
+def _mongo_condition( op, value, options ):
+    if op == 'eq':
+        return { '$eq' : value }
+
+    if op in _MONGO_OPS:
+        return { _MONGO_OPS[ op ] : value }
+
+    if op == 'between':
+        return { '$gte' : value[0], '$lte' : value[1] }
+
+    if op in ('like', 'ilike', 'regexp', 'nlike', 'nilike'):
+        pattern = _pattern( value, op, options )
+        regex = { '$regex' : pattern.pattern }
+        if pattern.flags & re.IGNORECASE:
+            regex[ '$options' ] = 'i'
+
+        return { '$not' : regex } if op in ('nlike', 'nilike') else regex
+
+    raise ValueError( 'Unsupported filter operator %s' % op )
+
+
+def compile_mongo( where ):
+    '''The where filter as a MongoDB query, for SciCat endpoints such as fullfacet that take one'''
+
+    where = _unwrap( where )
+    clauses = []
+
+    for key, condition in where.items():
+        if key in ('and', 'or'):
+            clauses.append( { '$' + key : [ compile_mongo( c ) for c in condition ] } )
+
+        elif isinstance( condition, dict ) and condition:
+            options = condition.get( 'options' )
+            for op, value in condition.items():
+                if op != 'options':
+                    clauses.append( { key : _mongo_condition( op, value, options ) } )
+
+        else:
+            clauses.append( { key : condition } )
+
+    if len( clauses ) == 1:
+        return clauses[0]
+
+    return { '$and' : clauses } if clauses else {}
+
+
+def facet_counts( records, facets ):
+    '''{ facet : { value : count } } over records, each element of a list value counted on its own'''
+
+    result = {}
+
+    for facet in facets:
+        get = _getter( facet )
+        counts = collections.Counter()
+
+        for record in records:
+            value = get( record )
+
+            if value is _MISSING:
+                continue
+
+            if isinstance( value, list ):
+                counts.update( v for v in value if not isinstance( v, (dict, list) ) )
+            elif not isinstance( value, dict ):
+                counts[ value ] += 1
+
+        result[ facet ] = dict( counts )
+
+    return result
@@ -0,0 +1,282 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from . _filters import Query, compile_sql, sql_regexp
+
+logger = logging.getLogger( __name__ )
+
+# dataset fields kept in their own indexed columns, the whole document is kept as well
+COLUMNS = ( 'pid', 'datasetName', 'type', 'owner', 'ownerGroup', 'sampleId', 'proposalId', 'instrumentId'
+            , 'sourceFolder', 'creationTime', 'createdAt', 'updatedAt' )
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS datasets (
+    pid TEXT PRIMARY KEY,
+    datasetName TEXT,
+    type TEXT,
+    owner TEXT,
+    ownerGroup TEXT,
+    sampleId TEXT,
+    proposalId TEXT,
+    instrumentId TEXT,
+    sourceFolder TEXT,
+    creationTime TEXT,
+    createdAt TEXT,
+    updatedAt TEXT,
+    scientificMetadata TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS datasets_updatedAt ON datasets (updatedAt);
+CREATE INDEX IF NOT EXISTS datasets_datasetName ON datasets (datasetName);
+CREATE INDEX IF NOT EXISTS datasets_owner ON datasets (owner);
+CREATE INDEX IF NOT EXISTS datasets_ownerGroup ON datasets (ownerGroup);
+CREATE INDEX IF NOT EXISTS datasets_sampleId ON datasets (sampleId);
+CREATE INDEX IF NOT EXISTS datasets_proposalId ON datasets (proposalId);
+CREATE INDEX IF NOT EXISTS datasets_instrumentId ON datasets (instrumentId);
+CREATE INDEX IF NOT EXISTS datasets_creationTime ON datasets (creationTime);
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def _column( field ):
+    '''SQL expression for a dataset field, dotted paths reach into scientificMetadata'''
+
+    if field in COLUMNS:
+        return field
+
+    head, _, path = field.partition( '.' )
+
+    if head == 'scientificMetadata' and path:
+        return "json_extract(scientificMetadata, '$.%s')" % path.replace( "'", "''" )
+
+    return "json_extract(doc, '$.%s')" % field.replace( "'", "''" )
+
+
+class DatasetMirror:
+    '''Local copy of the datasets a client can read, in a SQLite database.'''
+    '''sync fetches only datasets past the last (updatedAt, pid) seen, in that order, page_size at a time.'''
+    '''find answers where filters from the copy when it was synced within max_age seconds, and'''
+    '''from a stale copy when the server cannot be reached. updatedAt does not reveal deletions, so every'''
+    '''prune_interval seconds the pids on the server are listed and datasets gone from it dropped. Until'''
+    '''then, or with prune_interval None, the copy may still hold datasets deleted on the server'''
+
+    def __init__(self, path, client, max_age=60.0, page_size=1000, prune_interval=3600.0):
+        self.path = str( path )
+        self.client = client
+        self.max_age = max_age
+        self.page_size = page_size
+        self.prune_interval = prune_interval
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+        self._db = sqlite3.connect( self.path, check_same_thread=False )
+        self._db.execute( 'PRAGMA journal_mode=WAL' )
+        self._db.executescript( _SCHEMA )
+        self._db.create_function( 'REGEXP', 2, sql_regexp, deterministic=True )
+
+        # monotonic time of the last successful sync and prune
+        self.synced = None
+        self.pruned = None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute( 'SELECT COUNT(*) FROM datasets' ).fetchone()[0]
+
+    def _get_state(self, name, default=None):
+        row = self._db.execute( 'SELECT value FROM state WHERE name = ?', (name,) ).fetchone()
+        return json.loads( row[0] ) if row else default
+
+    def _set_state(self, name, value):
+        self._db.execute( 'INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)', (name, json.dumps( value )) )
+
+    def _get(self, query):
+        endpoint = 'Datasets?filter=%s' % urllib.parse.quote( json.dumps( query ) )
+
+        return self.client._call_endpoint( cmd='get', endpoint=endpoint, operation='Datasets', allow_404=True ) or []
+
+    def _fetch(self, position):
+        '''The page of datasets after position, an (updatedAt, pid) pair'''
+
+        query = { 'order' : [ 'updatedAt ASC', 'pid ASC' ], 'limit' : self.page_size }
+
+        if position is not None:
+            updated, pid = position
+            query[ 'where' ] = { 'or' : [ { 'updatedAt' : { 'gt' : updated } },
+                                          { 'and' : [ { 'updatedAt' : updated }, { 'pid' : { 'gt' : pid } } ] } ] }
+
+        return self._get( query )
+
+    def _store(self, docs):
+        rows = [ tuple( doc.get( c ) for c in COLUMNS )
+                 + ( json.dumps( doc.get( 'scientificMetadata' ) ), json.dumps( doc ) )
+                 for doc in docs ]
+
+        self._db.executemany( 'INSERT OR REPLACE INTO datasets (%s, scientificMetadata, doc) VALUES (%s)'
+                              % ( ', '.join( COLUMNS ), ', '.join( '?' * (len(COLUMNS) + 2) ) ), rows )
+
+    def sync(self):
+        '''Fetch datasets changed since the last sync, returns how many'''
+
+        with self._sync_lock:
+            with self._lock:
+                position = self._get_state( 'position' )
+
+                # copies from before positions were kept resume from the start of their cursor's timestamp
+                if position is None and self._get_state( 'cursor' ) is not None:
+                    position = [ self._get_state( 'cursor' ), '' ]
+
+            count = 0
+
+            while True:
+                page = self._fetch( position )
+
+                if page:
+                    # a dataset edited meanwhile moves past the position, so nothing is passed over
+                    position = [ page[-1].get( 'updatedAt' ), page[-1].get( 'pid' ) ]
+
+                with self._lock, self._db:
+                    self._store( page )
+                    self._set_state( 'position', position )
+
+                count += len( page )
+
+                if len( page ) < self.page_size:
+                    break
+
+            self.synced = time.monotonic()
+
+            return count
+
+    def prune(self):
+        '''Drop datasets no longer on the server, returns how many'''
+
+        with self._sync_lock:
+            pids = set()
+            last = None
+
+            while True:
+                query = { 'fields' : { 'pid' : True }, 'order' : 'pid ASC', 'limit' : self.page_size }
+                if last is not None:
+                    query[ 'where' ] = { 'pid' : { 'gt' : last } }
+
+                page = self._get( query )
+                pids.update( doc.get( 'pid' ) for doc in page )
+
+                if len( page ) < self.page_size:
+                    break
+
+                last = page[-1].get( 'pid' )
+
+            with self._lock, self._db:
+                local = [ pid for pid, in self._db.execute( 'SELECT pid FROM datasets' ) ]
+                gone = [ (pid,) for pid in local if pid not in pids ]
+                self._db.executemany( 'DELETE FROM datasets WHERE pid = ?', gone )
+
+            self.pruned = time.monotonic()
+
+            return len( gone )
+
+    def rebuild(self):
+        '''Drop the copy and sync everything again'''
+
+        with self._sync_lock:
+            with self._lock, self._db:
+                self._db.execute( 'DELETE FROM datasets' )
+                self._db.execute( 'DELETE FROM state' )
+
+            self.synced = None
+
+        return self.sync()
+
+    def fresh(self, max_age=None):
+        max_age = self.max_age if max_age is None else max_age
+        return self.synced is not None and time.monotonic() - self.synced <= max_age
+
+    def query(self, filter_fields):
+        '''Datasets matching filter_fields, a Query or filter, in the copy as it is, as the server would answer it.'''
+        '''None if the filter uses operators the copy cannot answer'''
+
+        try:
+            where, params = compile_sql( filter_fields, column=_column )
+        except (ValueError, TypeError):
+            return None
+
+        with self._lock:
+            rows = self._db.execute( 'SELECT doc FROM datasets WHERE ' + where, params ).fetchall()
+
+        # order, skip, limit and fields of a Query or whole filter
+        return Query.of( filter_fields ).select( json.loads( doc ) for doc, in rows )
+
+    def count(self, filter_fields=None):
+        '''Number of datasets matching the where filter filter_fields in the copy, None as for query'''
+
+        try:
+            where, params = compile_sql( filter_fields, column=_column )
+        except (ValueError, TypeError):
+            return None
+
+        with self._lock:
+            return self._db.execute( 'SELECT COUNT(*) FROM datasets WHERE ' + where, params ).fetchone()[0]
+
+    def facets(self, facets, filter_fields=None):
+        '''{ facet : { value : count } } of the datasets matching filter_fields in the copy, None as for query'''
+
+        try:
+            where, params = compile_sql( filter_fields, column=_column )
+        except (ValueError, TypeError):
+            return None
+
+        result = {}
+
+        with self._lock:
+            for facet in facets:
+                if facet in COLUMNS:
+                    sql = ( 'SELECT %s, COUNT(*) FROM datasets WHERE %s AND %s IS NOT NULL GROUP BY 1' % (facet, where, facet) )
+                else:
+                    # json_each gives one row for a plain value and one per element of a list
+                    sql = ( "SELECT e.value, COUNT(*) FROM datasets, json_each(datasets.doc, '$.%s') AS e "
+                            "WHERE %s AND e.type NOT IN ('object', 'array') GROUP BY 1" % (facet.replace( "'", "''" ), where) )
+
+                result[ facet ] = dict( self._db.execute( sql, params ).fetchall() )
+
+        return result
+
+    def refresh(self, max_age=None):
+        '''Sync, and prune when due, if the copy is older than max_age. If the sync fails a copy synced before is used as it is,'''
+        '''without one the error is raised'''
+
+        if not self.fresh( max_age ):
+            try:
+                self.sync()
+
+                if self.prune_interval is not None and ( self.pruned is None or time.monotonic() - self.pruned > self.prune_interval ):
+                    self.prune()
+
+            except Exception as e:
+                if self._get_state_locked( 'position' ) is None:
+                    raise
+
+                logger.warning( 'Dataset mirror not synced, using the local copy : %s' % e )
+
+    def find(self, filter_fields, max_age=None):
+        '''query after refresh'''
+
+        self.refresh( max_age )
+
+        return self.query( filter_fields )
+
+    def _get_state_locked(self, name):
+        with self._lock:
+            return self._get_state( name )
@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+
+from concurrent.futures import Future
+
+from . _filters import Property, Query
+
+logger = logging.getLogger( __name__ )
+
+# endpoint and id field of each kind of referenced entity
+KINDS = {
+    'sample' : ('Samples', 'sampleId'),
+    'proposal' : ('Proposals', 'proposalId'),
+    'instrument' : ('Instruments', 'pid'),
+}
+
+# dataset field -> kind
+DATASET_REFERENCES = {
+    'sampleId' : 'sample',
+    'proposalId' : 'proposal',
+    'instrumentId' : 'instrument',
+}
+
+
+class ReferenceResolver:
+    '''Looks up samples, proposals and instruments by id for a MyMetadataClient.'''
+    '''Lookups arriving within window seconds of each other, from any thread, are sent together as'''
+    '''one inq query per kind (split every batch_size ids). Found entities are cached for ttl seconds,'''
+    '''ids that do not exist for negative_ttl seconds'''
+
+    def __init__(self, client, ttl=300.0, negative_ttl=30.0, window=0.02, batch_size=100):
+        self.client = client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.window = window
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+
+        # (kind, id) -> (entity or None, expiry)
+        self._cache = {}
+
+        # kind -> (ids, Future) of the batch being collected
+        self._batches = {}
+
+        self.queries = 0
+
+    def _cached(self, kind, _id, now):
+        entry = self._cache.get( (kind, _id) )
+
+        if entry is not None and entry[1] > now:
+            return entry
+
+        return None
+
+    def _flush(self, kind):
+        with self._lock:
+            ids, future = self._batches.pop( kind )
+
+        try:
+            found = self._query( kind, sorted( ids ) )
+        except Exception as e:
+            future.set_exception( e )
+            return
+
+        now = time.monotonic()
+
+        with self._lock:
+            for _id in ids:
+                entity = found.get( _id )
+                self._cache[ (kind, _id) ] = ( entity, now + (self.ttl if entity is not None else self.negative_ttl) )
+
+        future.set_result( None )
+
+    def _query(self, kind, ids):
+        endpoint, field = KINDS[ kind ]
+
+        # split into requests of batch_size ids by the client
+        res = self.client.find( endpoint, Query( Property( field ).inq( *ids ) ), max_inq=self.batch_size, key=field )
+
+        self.queries += 1
+
+        return { entity.get( field ) : entity for entity in res or [] }
+
+    def _enqueue(self, kind, ids, now):
+        '''Add the ids of kind not cached to the batch being collected, returns its Future or None'''
+
+        if kind not in KINDS:
+            raise ValueError( 'Unknown reference kind %s' % kind )
+
+        missing = { _id for _id in ids if self._cached( kind, _id, now ) is None }
+
+        if not missing:
+            return None
+
+        batch = self._batches.get( kind )
+
+        if batch is None:
+            batch = self._batches[ kind ] = ( set(), Future() )
+
+            # the first caller starts the window, the query is sent when it closes
+            timer = threading.Timer( self.window, self._flush, (kind,) )
+            timer.daemon = True
+            timer.start()
+
+        batch[0].update( missing )
+
+        return batch[1]
+
+    def _lookup(self, wanted):
+        '''{ kind : { id : entity or None } } for { kind : ids }. Raises if a lookup failed'''
+
+        now = time.monotonic()
+
+        with self._lock:
+            futures = [ self._enqueue( kind, ids, now ) for kind, ids in wanted.items() ]
+
+        for future in futures:
+            if future is not None:
+                future.result()
+
+        with self._lock:
+            return { kind : { _id : self._cache[ (kind, _id) ][0] for _id in ids } for kind, ids in wanted.items() }
+
+    def resolve(self, kind, ids):
+        '''{ id : entity or None } for ids of one kind'''
+
+        ids = set( ids )
+
+        return self._lookup( { kind : ids } )[ kind ]
+
+    def get(self, kind, _id):
+        return self.resolve( kind, [ _id ] )[ _id ]
+
+    def missing(self, *datasets):
+        '''[ (field, id) ] of references in datasets to entities that do not exist'''
+
+        refs = set()
+
+        for ds in datasets:
+            for field in DATASET_REFERENCES:
+                _id = getattr( ds, field, None )
+                if _id:
+                    refs.add( (field, _id) )
+
+        wanted = {}
+        for field, _id in refs:
+            wanted.setdefault( DATASET_REFERENCES[ field ], set() ).add( _id )
+
+        found = self._lookup( wanted )
+
+        return [ (field, _id) for field, _id in sorted( refs ) if found[ DATASET_REFERENCES[ field ] ][ _id ] is None ]
+
+    def invalidate(self, kind=None, _id=None):
+        with self._lock:
+            if kind is None:
+                self._cache.clear()
+            else:
+                self._cache.pop( (kind, _id), None )
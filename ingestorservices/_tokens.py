@@ -0,0 +1,106 @@
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import time
+
+# posix only. Without it concurrent processes may each log in once
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class Token:
+
+    def __init__(self, token, issued, expires):
+        self.token = token
+        self.issued = issued
+        self.expires = expires
+
+    def fresh(self, now=None, margin=300):
+        '''True until margin seconds (at most a tenth of the lifetime) before expiry'''
+
+        now = time.time() if now is None else now
+        margin = min( margin, (self.expires - self.issued) / 10 )
+
+        return now < self.expires - margin
+
+
+class TokenCache:
+    '''Access tokens on disk, one file per (server, user) readable only by the owner.'''
+    '''Processes starting within a token's lifetime reuse it instead of logging in. Logins are'''
+    '''serialised with a file lock so that processes starting together share one login'''
+
+    def __init__(self, path, margin=300):
+        self.path = pathlib.Path( path )
+        self.margin = margin
+
+        self.path.mkdir( parents=True, exist_ok=True )
+        os.chmod( self.path, 0o700 )
+
+    def _file(self, base_url, username):
+        digest = hashlib.sha256( ('%s\0%s' % (base_url, username)).encode() ).hexdigest()
+        return self.path / ('%s.json' % digest[:32])
+
+    @contextlib.contextmanager
+    def _locked(self, path):
+        fd = os.open( str(path) + '.lock', os.O_RDWR | os.O_CREAT, 0o600 )
+
+        try:
+            if fcntl is not None:
+                fcntl.flock( fd, fcntl.LOCK_EX )
+            yield
+        finally:
+            os.close( fd )
+
+    def _read(self, path):
+        try:
+            with open( path, 'r' ) as f:
+                j = json.load( f )
+
+            return Token( j['token'], j['issued'], j['expires'] )
+
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write(self, path, token):
+        tmp = path.with_suffix( '.tmp' )
+
+        fd = os.open( tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600 )
+        with os.fdopen( fd, 'w' ) as f:
+            json.dump( { 'token' : token.token, 'issued' : token.issued, 'expires' : token.expires }, f )
+
+        os.replace( tmp, path )
+
+    def get(self, base_url, username, login, rejected=None):
+        '''A fresh Token for username on base_url, calling login() for a new one when needed.'''
+        '''rejected is a token string the server refused, it is not returned again'''
+
+        path = self._file( base_url, username )
+
+        def usable( token ):
+            return token is not None and token.token != rejected and token.fresh( margin=self.margin )
+
+        token = self._read( path )
+        if usable( token ):
+            return token
+
+        with self._locked( path ):
+
+            # another process may have logged in while we waited for the lock
+            token = self._read( path )
+            if usable( token ):
+                return token
+
+            token = login()
+            self._write( path, token )
+
+            return token
+
+    def invalidate(self, base_url, username):
+        try:
+            os.unlink( self._file( base_url, username ) )
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+
+from . _filters import Property, Query
+
+logger = logging.getLogger( __name__ )
+
+
+class DatasetWatch:
+    '''Iterates over datasets matching a filter as they are created or updated.'''
+    '''Each poll asks only for datasets whose updatedAt is at or past the last one seen, so an idle poll'''
+    '''returns nothing. The interval starts at interval, grows by backoff up to max_interval while nothing'''
+    '''arrives and drops back when something does. Iteration ends after timeout seconds or on stop.'''
+    '''With since=None datasets that already match are delivered first'''
+
+    def __init__(self, client, query, since=None, interval=1.0, max_interval=30.0, backoff=1.5, page_size=100, timeout=None):
+        self.client = client
+        self.query = Query.of( query )
+        self.min_interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.page_size = page_size
+        self.timeout = timeout
+
+        self.interval = interval
+
+        # updatedAt of the latest dataset seen, and the pids seen with that updatedAt
+        self.cursor = since
+        self._at_cursor = set()
+
+        self.evt_stop = threading.Event()
+
+        self.polls = 0
+
+    def stop(self):
+        self.evt_stop.set()
+
+    def poll(self):
+        '''Datasets changed since the last poll, oldest first'''
+
+        found = []
+
+        while True:
+            query = self.query.order( 'updatedAt ASC' ).limit( self.page_size + len( self._at_cursor ) )
+
+            if self.cursor is not None:
+                query = query.where( Property( 'updatedAt' ).gte( self.cursor ) )
+
+            page = self.client().find( 'Datasets', query ) or []
+            self.polls += 1
+
+            fresh = [ ds for ds in page if not ( ds.get( 'updatedAt' ) == self.cursor and ds.get( 'pid' ) in self._at_cursor ) ]
+
+            for ds in fresh:
+                updated = ds.get( 'updatedAt' )
+
+                if updated != self.cursor:
+                    self.cursor = updated
+                    self._at_cursor = set()
+
+                self._at_cursor.add( ds.get( 'pid' ) )
+
+            found.extend( fresh )
+
+            # a full page may have more behind it
+            if len( fresh ) < self.page_size:
+                return found
+
+    def __iter__(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+        while not self.evt_stop.is_set():
+            try:
+                found = self.poll()
+            except Exception as e:
+                logger.warning( 'Dataset watch poll failed : %s' % e )
+                found = []
+
+            if found:
+                self.interval = self.min_interval
+
+                for ds in found:
+                    yield ds
+
+                    if self.evt_stop.is_set():
+                        return
+            else:
+                self.interval = min( self.interval * self.backoff, self.max_interval )
+
+            wait = self.interval
+
+            if deadline is not None:
+                wait = min( wait, deadline - time.monotonic() )
+                if wait <= 0:
+                    return
+
+            self.evt_stop.wait( wait )
@@ -1,13 +1,85 @@
 
-from pyscicat.client import encode_thumbnail, ScicatClient
+from pyscicat.client import encode_thumbnail, ScicatClient, ScicatCommError, get_token
 
 from typing import Optional
+from urllib.parse import urljoin
 
-from . _filters import Property, _where_, _and_, _or_
+from . _filters import Property, Query, MAX_INQ, _where_, _and_, _or_, compile_mongo, facet_counts
+from . _resolver import ReferenceResolver
+from . _tokens import Token
+from . import metadata
 import json
+import logging
+import threading
+import time
+import urllib.parse
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger( __name__ )
+
+# lifetime assumed for tokens when the server does not say
+DEFAULT_TOKEN_TTL = 3600
+
+# zlib wbits for each Content-Encoding
+_WBITS = { "gzip": 31, "deflate": 15 }
+
+# buffered bodies smaller than this are sent as they are
+MIN_COMPRESS_SIZE = 1024
+
+
+def _compress( chunks, encoding, level=6 ):
+    z = zlib.compressobj( level, zlib.DEFLATED, _WBITS[ encoding ] )
+
+    for chunk in chunks:
+        out = z.compress( chunk )
+        if out:
+            yield out
+
+    yield z.flush()
+
+
+class ScicatServerError( ScicatCommError ):
+    '''The server failed or is overloaded (5xx, 408 or 429), the request may succeed if repeated'''
+
+    def __init__(self, message, status):
+        super().__init__( message )
+        self.status = status
+
+
+def login( session, base_url, username, password, timeout_seconds=None ):
+    '''Token for username, with its expiry from the ttl SciCat returns'''
+
+    now = time.time()
+
+    response = session.post( urljoin( base_url, "Users/login" )
+            , json={"username": username, "password": password}, timeout=timeout_seconds )
+
+    if response.ok:
+        j = response.json()
+        return Token( j["id"], now, now + (j.get("ttl") or DEFAULT_TOKEN_TTL) )
+
+    # not a functional account, let pyscicat try its other login routes
+    return Token( get_token( base_url, username, password ), now, now + DEFAULT_TOKEN_TTL )
+
+
+class ScicatReferenceError( ScicatCommError ):
+    '''A dataset refers to samples, proposals or instruments that do not exist'''
+
+    def __init__(self, message, missing):
+        super().__init__( message )
+        self.missing = missing
+
 
 class MyMetadataClient( ScicatClient ):
     """Responsible for communicating with the Scicat Catamel server via http"""
+    """All requests share one requests.Session. With a token_cache the token is taken from disk when"""
+    """still fresh, renewed shortly before it expires and renewed once if the server refuses it."""
+    """References of new datasets are checked through self.references first. check_references 'warn'"""
+    """logs unknown ones, 'reject' raises ScicatReferenceError, None skips the check"""
 
     def __init__(
             self,
@@ -16,25 +88,248 @@ class MyMetadataClient( ScicatClient ):
             username: str = None,
             password: str = None,
             timeout_seconds: int = None,
+            token_cache = None,
+            stream_uploads: bool = True,
+            compression: str = None,
+            check_references: str = "warn",
             ):
 
+        if base_url[-1] != "/":
+            base_url = base_url + "/"
+
+        self._session = requests.Session()
+        self._token_cache = token_cache
+        self._stream_uploads = stream_uploads
+
+        if compression not in (None, "gzip", "deflate", "auto"):
+            raise ValueError( "Unknown compression %s" % compression )
+
+        if check_references not in (None, "warn", "reject"):
+            raise ValueError( "Unknown check_references %s" % check_references )
+
+        self._check_references = check_references
+        self.references = ReferenceResolver( self )
+
+        self._compression = compression
+        self._encoding = "gzip" if compression == "auto" else compression
+
+        self._session.headers["Accept-Encoding"] = "gzip, deflate"
+
+        self._stats_lock = threading.Lock()
+        self._stats = { "requests": 0, "body_bytes": 0, "sent_bytes": 0, "content_bytes": 0, "received_bytes": 0, "seconds": 0.0 }
+        self._token_info = None
+        self._token_lock = threading.Lock()
+
+        if not token and token_cache is not None and username is not None:
+            self._token_info = token_cache.get( base_url, username, self._login_fn( base_url, username, password, timeout_seconds ) )
+            token = self._token_info.token
+
         super().__init__( base_url, token, username, password, timeout_seconds )
 
-    #https://loopback.io/doc/en/lb3/Where-filter.html
-    def samples_query( self, *args ):
-        query = {}
+    def _login_fn( self, base_url, username, password, timeout_seconds ):
+        return lambda: login( self._session, base_url, username, password, timeout_seconds )
+
+    def _renew_token( self, rejected=None ):
+        with self._token_lock:
+            if rejected is not None and rejected != self._token:
+                # another thread already renewed it
+                return
+
+            self._token_info = self._token_cache.get( self._base_url, self._username
+                    , self._login_fn( self._base_url, self._username, self._password, self._timeout_seconds )
+                    , rejected=rejected )
+
+            self._token = self._token_info.token
+            self._headers["Authorization"] = "Bearer {}".format(self._token)
+
+    def _count( self, chunks, key ):
+        for chunk in chunks:
+            with self._stats_lock:
+                self._stats[ key ] += len( chunk )
+            yield chunk
+
+    def transfer_stats( self ):
+        """Bytes of request bodies before and after compression, of responses on the wire and decoded, and time spent"""
+
+        with self._stats_lock:
+            stats = dict( self._stats )
+
+        stats["upload_ratio"] = stats["sent_bytes"] / stats["body_bytes"] if stats["body_bytes"] else 1.0
+        stats["download_ratio"] = stats["received_bytes"] / stats["content_bytes"] if stats["content_bytes"] else 1.0
+
+        return stats
+
+    def _request( self, cmd, endpoint, data=None ):
+        headers = self._headers
+        body = None
+        encoding = None
+
+        if data is not None:
+            headers = { **headers, "Content-Type": "application/json" }
+
+            # a generator body is sent with chunked transfer encoding
+            body = self._count( metadata.iter_json( data ), "body_bytes" )
+            encoding = self._encoding
+
+            if not self._stream_uploads:
+                body = b"".join( body )
+                if len( body ) < MIN_COMPRESS_SIZE:
+                    encoding = None
+
+            if encoding:
+                headers["Content-Encoding"] = encoding
+                body = _compress( body if self._stream_uploads else [ body ], encoding )
+
+                if not self._stream_uploads:
+                    body = b"".join( body )
+
+            if self._stream_uploads:
+                body = self._count( body, "sent_bytes" )
+            else:
+                with self._stats_lock:
+                    self._stats[ "sent_bytes" ] += len( body )
+
+        start = time.perf_counter()
 
-        query.update( _where_( *args ) )
+        response = self._session.request(
+            method=cmd,
+            url=urljoin(self._base_url, endpoint),
+            data=body,
+            params={"access_token": self._token},
+            headers=headers,
+            timeout=self._timeout_seconds,
+            stream=False,
+            verify=True,
+        )
 
-        j_query = json.dumps( query )
+        with self._stats_lock:
+            self._stats[ "requests" ] += 1
+            self._stats[ "seconds" ] += time.perf_counter() - start
+            self._stats[ "content_bytes" ] += len( response.content )
+            self._stats[ "received_bytes" ] += response.raw.tell() if response.raw is not None else len( response.content )
 
-        endpoint = f"Samples?filter={j_query}"
+        if encoding and self._compression == "auto" and response.status_code == 415:
+            # the server does not take compressed bodies, stop sending them
+            self._encoding = None
+            return self._request( cmd, endpoint, data )
 
+        return response
+
+    def _send_to_scicat( self, cmd, endpoint, data=None ):
+        renewable = self._token_info is not None
+
+        if renewable and not self._token_info.fresh( margin=self._token_cache.margin ):
+            self._renew_token()
+
+        token = self._token
+        response = self._request( cmd, endpoint, data )
+
+        if renewable and response.status_code == 401:
+            self._renew_token( rejected=token )
+            response = self._request( cmd, endpoint, data )
+
+        return response
+
+    def _call_endpoint( self, cmd, endpoint, data=None, operation="", allow_404=False ):
+        response = self._send_to_scicat( cmd=cmd, endpoint=endpoint, data=data )
+
+        if allow_404 and response.status_code == 404:
+            return None
+
+        if response.status_code >= 500 or response.status_code in (408, 429):
+            raise ScicatServerError( f"Error in operation {operation}: {response.status_code} {response.reason}", response.status_code )
+
+        result = response.json() if len(response.content) > 0 else None
+        if not response.ok:
+            raise ScicatCommError( f"Error in operation {operation}: {result}" )
+
+        return result
+
+    def _parallel( self, fn, items, workers=8 ):
+        if len( items ) == 1:
+            return [ fn( items[0] ) ]
+
+        with ThreadPoolExecutor( max_workers=min( workers, len( items ) ) ) as executor:
+            return list( executor.map( fn, items ) )
+
+    def find( self, endpoint, query, max_inq=MAX_INQ, workers=8, key="pid" ):
+        """Records of endpoint (e.g. "Datasets") matching a Query. Long inq lists are sent as several"""
+        """requests in parallel and their results merged, telling records apart by their key field"""
+
+        def get( q ):
+            return self._call_endpoint( cmd="get"
+                    , endpoint=f"{endpoint}?filter={q.encoded}", operation=endpoint, allow_404=True )
+
+        chunks = query.chunks( max_inq )
+
+        if len( chunks ) == 1:
+            return get( query )
+
+        fields = query.filter.get( "fields" )
+        names = [ name for name, on in fields.items() if on ] if isinstance( fields, dict ) else list( fields or [] )
+
+        # merge needs the key of every record, fetch it with the fields asked for and drop it after
+        extra = bool( names ) and key not in names
+
+        if extra:
+            query = query.fields( *names, key )
+            chunks = query.chunks( max_inq )
+
+        records = query.merge( self._parallel( get, chunks, workers ), key )
+
+        if extra:
+            for record in records:
+                record.pop( key, None )
+
+        return records
+
+    def count( self, endpoint, query=None, max_inq=MAX_INQ, workers=8, key="pid" ) -> int :
+        """Number of records of endpoint matching a Query or where filter, counted by the server."""
+        """A query split for long inq lists could count a record once per chunk, so then only the key"""
+        """field of the matches is fetched and distinct keys are counted"""
+
+        query = Query.of( query )
+        chunks = query.chunks( max_inq )
+
+        if len( chunks ) > 1:
+            return len( self.find( endpoint, query.fields( key ).limit( None ), max_inq, workers, key ) or [] )
+
+        where = urllib.parse.quote( json.dumps( query.filter.get( "where", {} ) ) )
         res = self._call_endpoint( cmd="get"
-                , endpoint=endpoint, operation="Samples", allow_404=True )
+                , endpoint=f"{endpoint}/count?where={where}", operation=f"{endpoint}/count" )
 
-        return res
+        return res[ "count" ]
+
+    def facets( self, endpoint, facets, query=None ) -> dict :
+        """{ facet : { value : count } } of the records of endpoint matching a Query or where filter,"""
+        """grouped by the server. Where there is no fullfacet endpoint only the facet fields are fetched"""
+
+        query = Query.of( query )
+        where = query.filter.get( "where" )
+
+        fields = urllib.parse.quote( json.dumps( { "mode" : compile_mongo( where ) } if where else {} ) )
+        names = urllib.parse.quote( json.dumps( list( facets ) ) )
+
+        res = self._call_endpoint( cmd="get"
+                , endpoint=f"{endpoint}/fullfacet?fields={fields}&facets={names}", operation=f"{endpoint}/fullfacet", allow_404=True )
+
+        if res is not None:
+            groups = res[0] if isinstance( res, list ) and res else {}
+            return { facet : { g[ "_id" ] if not isinstance( g[ "_id" ], list ) else tuple( g[ "_id" ] ) : g[ "count" ]
+                               for g in groups.get( facet, [] ) }
+                     for facet in facets }
+
+        # the key keeps records that match more than one chunk of a split query from counting twice
+        records = self.find( endpoint, query.fields( *facets, "pid" ) ) or []
+        return facet_counts( records, facets )
+
+    #https://loopback.io/doc/en/lb3/Where-filter.html
+    def samples_query( self, *args ):
+        query = args[0] if len( args ) == 1 and isinstance( args[0], Query ) else Query( *args )
 
+        res = self.find( "Samples", query )
+
+        return res
 
     def samples_get( self, like_sampleId ) -> Optional[dict] :
 
@@ -45,24 +340,48 @@ class MyMetadataClient( ScicatClient ):
         return res
 
     def dataset_query( self, *args ):
-        query = {}
+        query = args[0] if len( args ) == 1 and isinstance( args[0], Query ) else Query( *args )
+
+        res = self.find( "Datasets", query )
 
-        query.update( _where_( *args ) )
+        return res
 
-        j_query = json.dumps( query )
+    def samples_resolve( self, *sampleIds ) -> dict :
+        """{ sampleId : sample or None }, batched and cached by self.references"""
 
-        endpoint = f"Datasets?filter={j_query}"
+        return self.references.resolve( "sample", sampleIds )
 
-        res = self._call_endpoint( cmd="get"
-                , endpoint=endpoint, operation="Datasets", allow_404=True )
+    def check_references( self, *datasets ):
+        """Log references of datasets to entities that do not exist, or with check_references "reject" raise"""
+        """ScicatReferenceError. A lookup that fails is logged and never blocks the upload"""
 
-        return res
+        if not self._check_references:
+            return
+
+        try:
+            missing = self.references.missing( *datasets )
+        except Exception as e:
+            # the upload meets the same server and fails or is deferred there
+            logger.warning( "Reference check failed : %s" % e )
+            return
+
+        if not missing:
+            return
+
+        message = "Unknown references %s" % ", ".join( "%s=%s" % m for m in missing )
+
+        if self._check_references == "reject":
+            raise ScicatReferenceError( message, missing )
+
+        logger.warning( message )
 
     def upload_new_dataset( self, *args ):
 
         #for i, arg in enumerate(args):
         #    print( i, type(arg) )
 
+        self.check_references( *args[:1] )
+
         res = super().upload_new_dataset( *args )
 
         return res
@@ -1 +1,4 @@
-from . _model import Dataset, Ownable
+from . _model import Dataset, Ownable, Attachment
+from . _builder import DatasetBuilder
+from . _datablock import DatablockBuilder, Inventory, OrigDatablock
+from . _serialize import iter_json, write_json
@@ -0,0 +1,72 @@
+import pydantic
+
+from . _model import Dataset
+
+_setattr = object.__setattr__
+
+
+class DatasetBuilder:
+    '''Stamps out Datasets that share most of their fields.'''
+    '''The template (owner, groups, instrument, proposal...) is validated once. build() validates only'''
+    '''the fields it is given and assembles the model from the two without validating it again.'''
+    '''Template values are shared by every dataset built, treat them as read only'''
+
+    def __init__(self, wrapper=Dataset, **template):
+        self.wrapper = wrapper
+        self.model = wrapper._model
+
+        self._fields = self.model.model_fields
+        self._required = { name for name, field in self._fields.items() if field.is_required() }
+
+        # validators, one per sequence of field names given to build()
+        self._validators = {}
+
+        template = self._validate( template )
+
+        self._defaults = { name : field.get_default( call_default_factory=True )
+                           for name, field in self._fields.items() if not field.is_required() }
+
+        self._template = { **self._defaults, **template }
+        self._template_set = frozenset( template )
+
+    def _validate(self, values):
+        key = tuple( values )
+
+        entry = self._validators.get( key )
+
+        if entry is None:
+            # fields the model does not have are ignored, as the model itself does
+            names = [ name for name in key if name in self._fields ]
+
+            model = pydantic.create_model( self.model.__name__ + 'Fields'
+                    , **{ name : (self._fields[ name ].annotation, ...) for name in names } )
+
+            entry = self._validators[ key ] = ( names, model.__pydantic_validator__, len( names ) == len( key ) )
+
+        names, validator, exact = entry
+
+        if not exact:
+            values = { name : values[ name ] for name in names }
+
+        return validator.validate_python( values ).__dict__
+
+    def build(self, **fields):
+        validated = self._validate( fields )
+
+        values = dict( self._template )
+        values.update( validated )
+
+        fields_set = set( self._template_set )
+        fields_set.update( validated )
+
+        if not self._required.issubset( fields_set ):
+            raise ValueError( '%s missing fields %s' % (self.model.__name__, sorted( self._required - fields_set )) )
+
+        # what model_construct does, less recomputing the defaults each time
+        obj = self.model.__new__( self.model )
+        _setattr( obj, '__dict__', values )
+        _setattr( obj, '__pydantic_fields_set__', fields_set )
+        _setattr( obj, '__pydantic_extra__', None )
+        _setattr( obj, '__pydantic_private__', None )
+
+        return self.wrapper.from_model( obj )
@@ -0,0 +1,196 @@
+import datetime
+import hashlib
+import os
+import sqlite3
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import pyscicat
+
+from . _model import Base
+
+# files per OrigDatablock upload
+FILES_PER_BLOCK = 10000
+
+CHUNK_SIZE = 1 << 20
+
+
+FileEntry = namedtuple( 'FileEntry', ['path', 'size', 'mtime_ns', 'chk'] )
+
+
+class OrigDatablock(Base):
+    _model = pyscicat.model.CreateDatasetOrigDatablockDto
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(pyscicat.model.CreateDatasetOrigDatablockDto( **kwargs ))
+
+
+class Inventory:
+    '''Files below a source folder, paths relative to it, with checksums made by chk_alg'''
+
+    def __init__(self, source_folder, files, chk_alg=None):
+        self.source_folder = source_folder
+        self.files = files
+        self.chk_alg = chk_alg
+
+    @property
+    def size(self):
+        return sum( f.size for f in self.files )
+
+    def __len__(self):
+        return len( self.files )
+
+    def datablocks(self, files_per_block=FILES_PER_BLOCK):
+        '''OrigDatablock payloads of at most files_per_block files each'''
+
+        for i in range( 0, len(self.files), files_per_block ):
+            chunk = self.files[ i : i + files_per_block ]
+
+            # values are already typed, skip per file validation
+            data_files = [ pyscicat.model.DataFile.model_construct(
+                                path=f.path,
+                                size=f.size,
+                                time=datetime.datetime.fromtimestamp( f.mtime_ns / 1e9 ).isoformat(),
+                                chk=f.chk )
+                           for f in chunk ]
+
+            # constructed too: pyscicat types chkAlg as int, SciCat takes the algorithm name
+            yield OrigDatablock.from_model( pyscicat.model.CreateDatasetOrigDatablockDto.model_construct(
+                                                size=sum( f.size for f in chunk ),
+                                                dataFileList=data_files,
+                                                chkAlg=self.chk_alg ) )
+
+
+class _ChecksumCache:
+    '''Checksums keyed by (path, mtime, size) in a sqlite file, so unchanged files are not re-read'''
+
+    def __init__(self, path):
+        self._db = sqlite3.connect( str(path) )
+        self._db.execute( 'CREATE TABLE IF NOT EXISTS checksums '
+                          '(path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, chk TEXT)' )
+
+    def load(self, prefix):
+        rows = self._db.execute( 'SELECT path, mtime_ns, size, chk FROM checksums WHERE substr(path, 1, ?) = ?'
+                                 , (len(prefix), prefix) )
+
+        return { path : (mtime_ns, size, chk) for path, mtime_ns, size, chk in rows }
+
+    def store(self, rows):
+        with self._db:
+            self._db.executemany( 'INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?)', rows )
+
+    def close(self):
+        self._db.close()
+
+
+def _scan_directory( path ):
+    '''(files, subdirectories) of one directory, files as (path, size, mtime_ns)'''
+
+    files = []
+    dirs = []
+
+    with os.scandir( path ) as it:
+        for entry in it:
+            try:
+                if entry.is_dir( follow_symlinks=False ):
+                    dirs.append( entry.path )
+                elif entry.is_file( follow_symlinks=False ):
+                    st = entry.stat( follow_symlinks=False )
+                    files.append( (entry.path, st.st_size, st.st_mtime_ns) )
+            except OSError:
+                pass
+
+    return files, dirs
+
+
+def _checksum( path, algorithm ):
+    h = hashlib.new( algorithm )
+
+    with open( path, 'rb' ) as f:
+        for chunk in iter( lambda: f.read( CHUNK_SIZE ), b'' ):
+            h.update( chunk )
+
+    return h.hexdigest()
+
+
+class DatablockBuilder:
+    '''Inventory a dataset sourceFolder for OrigDatablocks.'''
+    '''Directories are listed with os.scandir across a thread pool. With checksum set (e.g. 'md5')'''
+    '''files are also hashed on the pool, reusing cached results for unchanged files and any checksums'''
+    '''passed to inventory, e.g. from a bag manifest already verified'''
+
+    def __init__(self, checksum=None, cache_path=None, workers=None):
+        self.checksum = checksum
+        self.cache_path = cache_path
+        self.workers = workers
+
+    def _walk(self, executor, source_folder):
+        files = []
+
+        pending = { executor.submit( _scan_directory, source_folder ) }
+
+        while pending:
+            done, pending = wait( pending, return_when=FIRST_COMPLETED )
+
+            for future in done:
+                try:
+                    _files, _dirs = future.result()
+                except OSError:
+                    continue
+
+                files.extend( _files )
+                pending.update( executor.submit( _scan_directory, d ) for d in _dirs )
+
+        return files
+
+    def inventory(self, source_folder, checksums=None):
+        '''checksums maps paths relative to source_folder, / separated, to known digests of self.checksum'''
+
+        source_folder = os.path.abspath( source_folder )
+
+        # every path starts with source_folder, slicing is much cheaper than relpath
+        n = len( source_folder ) + 1
+
+        known = checksums or {}
+
+        with ThreadPoolExecutor( max_workers=self.workers ) as executor:
+
+            found = self._walk( executor, source_folder )
+
+            checksums = {}
+
+            if self.checksum:
+                cache = _ChecksumCache( self.cache_path ) if self.cache_path else None
+                cached = cache.load( source_folder + os.sep ) if cache else {}
+
+                todo = []
+
+                for path, size, mtime_ns in found:
+                    hit = cached.get( path )
+                    chk = known.get( path[n:].replace( os.sep, '/' ) )
+
+                    if chk is not None:
+                        checksums[ path ] = chk
+                    elif hit and hit[0] == mtime_ns and hit[1] == size:
+                        checksums[ path ] = hit[2]
+                    else:
+                        todo.append( (path, size, mtime_ns) )
+
+                results = executor.map( lambda f: _checksum( f[0], self.checksum ), todo )
+
+                rows = []
+                for (path, size, mtime_ns), chk in zip( todo, results ):
+                    checksums[ path ] = chk
+                    rows.append( (path, mtime_ns, size, chk) )
+
+                if cache:
+                    cache.store( rows )
+                    cache.close()
+
+        files = [ FileEntry( path[n:], size, mtime_ns, checksums.get( path ) )
+                  for path, size, mtime_ns in found ]
+
+        files.sort()
+
+        return Inventory( source_folder, files, self.checksum )
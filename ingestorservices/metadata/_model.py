@@ -1,10 +1,33 @@
+import operator
+
 import pyscicat
 
 class Base:
+    '''Wraps a pyscicat model. Its fields are read through properties made once per class, other'''
+    '''attributes are forwarded by __getattr__'''
+
+    # the pyscicat model class wrapped
+    _model = None
+
+    def __init_subclass__( cls, **kwargs ):
+        super().__init_subclass__( **kwargs )
+
+        if cls._model is not None:
+            for name in cls._model.model_fields:
+                if not hasattr( cls, name ):
+                    setattr( cls, name, property( operator.attrgetter( '_scicat_model.' + name ) ) )
 
     def __init__( self, scicat_model):
         self._scicat_model = scicat_model
 
+    @classmethod
+    def from_model( cls, scicat_model ):
+        '''Wrap an already validated model'''
+
+        obj = cls.__new__( cls )
+        obj._scicat_model = scicat_model
+        return obj
+
     def __getattr__(self, name ):
 
         return getattr( self._scicat_model, name )
@@ -14,12 +37,21 @@ class Base:
 
 
 class Ownable(Base):
+    _model = pyscicat.model.Ownable
 
     def __init__(self, *args, **kwargs):
         super().__init__(pyscicat.model.Ownable( **kwargs ))
 
 
 class Dataset(Base):
+    _model = pyscicat.model.RawDataset
 
     def __init__(self, *args, **kwargs):
         super().__init__(pyscicat.model.RawDataset( **kwargs ))
+
+
+class Attachment(Base):
+    _model = pyscicat.model.Attachment
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(pyscicat.model.Attachment( **kwargs ))
@@ -0,0 +1,121 @@
+import datetime
+import enum
+import io
+import json
+
+import pydantic
+
+from . _model import Base
+
+# orjson is optional, it encodes the leaves and flat lists much faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# bytes per chunk yielded
+CHUNK_SIZE = 1 << 16
+
+# elements of a flat list encoded per call
+SLICE = 4096
+
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def _default( value ):
+    if isinstance( value, enum.Enum ):
+        return value.value
+    if isinstance( value, (datetime.datetime, datetime.date) ):
+        return value.isoformat()
+    if isinstance( value, pydantic.BaseModel ):
+        return value.model_dump( mode='json', exclude_none=True )
+    raise TypeError( 'Object of type %s is not JSON serializable' % type(value).__name__ )
+
+
+if orjson is not None:
+    def _dumps( value ):
+        return orjson.dumps( value, default=_default )
+else:
+    def _dumps( value ):
+        return json.dumps( value, default=_default, allow_nan=False, separators=(',', ':') ).encode()
+
+
+def _fields( model ):
+    # the model's values as they are, none of model_dump's copying
+    for name in model.model_fields:
+        value = getattr( model, name )
+        if value is not None:
+            yield name, value
+
+
+def _encode( value ):
+    if isinstance( value, Base ):
+        value = value._scicat_model
+
+    if isinstance( value, pydantic.BaseModel ):
+        yield b'{'
+        for i, (name, v) in enumerate( _fields( value ) ):
+            yield b',' if i else b''
+            yield _dumps( name )
+            yield b':'
+            yield from _encode( v )
+        yield b'}'
+
+    elif isinstance( value, dict ):
+        yield b'{'
+        for i, (k, v) in enumerate( value.items() ):
+            yield b',' if i else b''
+            yield _dumps( str(k) )
+            yield b':'
+            yield from _encode( v )
+        yield b'}'
+
+    elif isinstance( value, (list, tuple) ):
+        yield b'['
+        if all( isinstance( v, _SCALARS ) for v in value ):
+            # flat, e.g. a numeric series. Encoded a slice at a time without the brackets
+            for i in range( 0, len(value), SLICE ):
+                yield b',' if i else b''
+                yield _dumps( value[ i : i + SLICE ] )[ 1 : -1 ]
+        else:
+            for i, v in enumerate( value ):
+                yield b',' if i else b''
+                yield from _encode( v )
+        yield b']'
+
+    else:
+        yield _dumps( value )
+
+
+def iter_json( obj, chunk_size=CHUNK_SIZE ):
+    '''JSON of a metadata object, pydantic model or plain value as a stream of bytes chunks.'''
+    '''None valued model fields are left out, as pyscicat does. Only one chunk is held at a time,'''
+    '''so large scientificMetadata is never copied whole. Can be passed as a requests body'''
+
+    buf = []
+    size = 0
+
+    for piece in _encode( obj ):
+        buf.append( piece )
+        size += len( piece )
+
+        if size >= chunk_size:
+            yield b''.join( buf )
+            buf = []
+            size = 0
+
+    if buf:
+        yield b''.join( buf )
+
+
+def write_json( obj, f, chunk_size=CHUNK_SIZE ):
+    '''Stream the JSON of obj to a path or an open file, binary or text'''
+
+    if isinstance( f, (str, bytes) ) or hasattr( f, '__fspath__' ):
+        with open( f, 'wb' ) as fp:
+            return write_json( obj, fp, chunk_size )
+
+    text = isinstance( f, io.TextIOBase )
+
+    for chunk in iter_json( obj, chunk_size ):
+        f.write( chunk.decode() if text else chunk )
@@ -1,11 +1,16 @@
 import logging
 import threading
+import time
 
 logger = logging.getLogger( __name__ )
 
 from .. import properties
 from .. import core
 
+from . _workqueue import WorkQueue, Priority
+from . _durable import DurableQueue, Lease
+from . _consumer import Consumer
+
 log_decorator = core.create_logger_decorator( logger )
 
 
@@ -38,8 +43,26 @@ class PluginBase:
     def stop(self):
         pass
 
-    def join(self):
-        self.t.join()
+    def join(self, timeout=None):
+        t = getattr( self, 't', None )
+
+        if t is not None:
+            t.join( timeout )
+
+    def is_alive(self):
+        t = getattr( self, 't', None )
+
+        return t is not None and t.is_alive()
+
+    def drain(self, deadline):
+        '''Stop taking new work, finish what is in hand by deadline (a time.monotonic() value) and stop.'''
+        '''Returns a report of what was flushed. Plugins with queues override this to empty them'''
+
+        self.stop()
+        self.join( max( 0, deadline - time.monotonic() ) )
 
+        return { 'stopped' : not self.is_alive() }
 
 
+# after PluginBase, which it extends
+from . _async import AsyncPluginBase, HostLoop
@@ -0,0 +1,162 @@
+import asyncio
+import functools
+import logging
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError
+
+logger = logging.getLogger( __name__ )
+
+from . import PluginBase
+from . _workqueue import Priority
+
+
+class HostLoop:
+    '''One asyncio event loop thread shared by all async plugins, with a thread pool for blocking calls.'''
+    '''The loop is started on first use. Once stopped it is not started again, using it raises RuntimeError'''
+
+    def __init__(self, workers=8):
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._stopped = False
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError( 'HostLoop is stopped' )
+
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._executor = ThreadPoolExecutor( max_workers=self.workers, thread_name_prefix='HostLoop' )
+                self._loop.set_default_executor( self._executor )
+
+                self._thread = threading.Thread( target=self._loop.run_forever, name='HostLoop', daemon=True )
+                self._thread.start()
+
+            return self._loop
+
+    def submit(self, coro):
+        '''Schedule coro on the loop from any thread, returns a concurrent.futures.Future'''
+        return asyncio.run_coroutine_threadsafe( coro, self.loop )
+
+    def call_soon(self, fn, *args):
+        self.loop.call_soon_threadsafe( fn, *args )
+
+    def stop(self):
+        with self._lock:
+            loop, thread, executor = self._loop, self._thread, self._executor
+            self._loop = None
+            self._stopped = True
+
+        if loop is None:
+            return
+
+        loop.call_soon_threadsafe( loop.stop )
+        thread.join()
+        loop.close()
+        executor.shutdown( wait=False )
+
+
+class _Inbox:
+    '''Receives watcher deliveries on the watcher thread for a coroutine to await.'''
+    '''Has the put signature of WorkQueue, raising queue.Full when maxsize items are waiting'''
+
+    def __init__(self, host_loop, maxsize=1000):
+        self.host_loop = host_loop
+        self.maxsize = maxsize
+
+        self._lock = threading.Lock()
+        self._count = 0
+        self._q = asyncio.Queue()
+
+    def put(self, item, block=False, timeout=None, priority=Priority.LIVE, key=None, version=None):
+        with self._lock:
+            if self._count >= self.maxsize:
+                raise queue.Full
+            self._count += 1
+
+        self.host_loop.call_soon( self._q.put_nowait, item )
+
+    async def get(self):
+        item = await self._q.get()
+
+        with self._lock:
+            self._count -= 1
+
+        return item
+
+
+class AsyncPluginBase( PluginBase ):
+    '''Base for plugins written as coroutines.'''
+    '''run() is a coroutine scheduled on the host's shared event loop rather than a thread of its own.'''
+    '''Use watch() for spool files and offload() for blocking work such as extractors and uploads,'''
+    '''which runs on the loop's thread pool'''
+
+    def __init__(self, host_services):
+        super().__init__( host_services )
+
+        self._future = None
+
+    @property
+    def host_loop(self):
+        return self.host_services.loop
+
+    async def run(self):
+        pass
+
+    async def _main(self):
+        try:
+            await self.run()
+        except asyncio.CancelledError:
+            pass
+
+    def start(self):
+        self._future = self.host_loop.submit( self._main() )
+
+    def stop(self):
+        if self.is_alive():
+            self.host_loop.call_soon( self._future.cancel )
+
+    def join(self, timeout=None):
+        '''Wait up to timeout seconds for run to finish. Like Thread.join, returns either way'''
+
+        if self._future is None:
+            return
+
+        try:
+            self._future.result( timeout )
+        except (CancelledError, TimeoutError):
+            pass
+        except Exception as e:
+            # a thread's exception is not raised by join either
+            logger.exception( e )
+
+    def is_alive(self):
+        return self._future is not None and not self._future.done()
+
+    async def offload(self, fn, *args, **kwargs):
+        '''fn( *args, **kwargs ) on the executor, without blocking the loop'''
+        return await asyncio.get_running_loop().run_in_executor( None, functools.partial( fn, *args, **kwargs ) )
+
+    async def watch(self, root, pattern, settle=0, maxsize=1000):
+        '''Async iterator of paths matching pattern below root, as delivered by the host watcher'''
+
+        inbox = _Inbox( self.host_loop, maxsize )
+        subscription = self.host_services.watcher.subscribe( root, pattern, inbox, settle=settle )
+
+        try:
+            while True:
+                yield await inbox.get()
+        finally:
+            self.host_services.watcher.unsubscribe( subscription )
+
+    async def save_dataset(self, ds, **kwargs):
+        kwargs.setdefault( 'owner', type(self).__name__ )
+
+        return await asyncio.wrap_future( self.host_services.requestDatasetSave( ds, **kwargs ) )
@@ -0,0 +1,83 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger( __name__ )
+
+from .. import core
+
+
+class Consumer( threading.Thread ):
+    '''Takes items off a DurableQueue in its own thread and emits each with sigDataAvailable.'''
+    '''An item is acked once the handlers return, and put back to retry if one raises, after a delay'''
+    '''doubling with each failed attempt up to max_delay seconds. After max_attempts it is failed instead,'''
+    '''see DurableQueue.failures, with max_attempts None it is retried for ever'''
+
+    def __init__(self, q_in, max_delay=300, max_attempts=10, daemon=None):
+        super().__init__( daemon=daemon )
+
+        self.q_in = q_in
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+        self.count = 0
+        self.done = 0
+
+        self.evt_stop = threading.Event()
+        self.evt_drain = threading.Event()
+
+        # item
+        self.sigDataAvailable = core.Signal()
+
+    def stop(self):
+        self.evt_stop.set()
+
+    def run(self):
+        while not self.evt_stop.is_set():
+
+            self.count += 1
+
+            try:
+                lease = self.q_in.lease( timeout=0.2 )
+            except queue.Empty:
+                if self.evt_drain.is_set():
+                    break
+                continue
+
+            try:
+                self.sigDataAvailable.emit( lease.item )
+
+                self.q_in.ack( lease )
+                self.done += 1
+            except Exception as e:
+                logger.exception( e )
+
+                if self.max_attempts is not None and lease.attempts >= self.max_attempts:
+                    logger.error( 'Giving up on %s after %d attempts' % (lease.key, lease.attempts) )
+                    self.q_in.fail( lease, e )
+                else:
+                    # retry later, backing off with each failed attempt
+                    self.q_in.nack( lease, delay=min( 2 ** lease.attempts, self.max_delay ) )
+
+    def drain(self, deadline, grace=30.0):
+        '''Keep taking items until the queue is empty or deadline (a time.monotonic() value) passes, then stop.'''
+        '''An item in hand at the deadline has up to grace seconds more to finish. Returns a report as PluginBase.drain'''
+
+        done = self.done
+
+        self.evt_drain.set()
+        self.join( max( 0, deadline - time.monotonic() ) )
+
+        # past the deadline, finish the current item only
+        self.stop()
+        self.join( grace )
+
+        stopped = not self.is_alive()
+
+        # anything still leased is picked up again on the next start. An item still in hand keeps its lease,
+        # that is reclaimed once this process has exited
+        if stopped:
+            self.q_in.release()
+
+        return { 'flushed' : self.done - done, 'checkpointed' : self.q_in.qsize(), 'stopped' : stopped }
@@ -0,0 +1,356 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from collections import namedtuple
+
+from . _workqueue import Priority
+
+
+Lease = namedtuple( 'Lease', ['id', 'key', 'item', 'attempts'] )
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    item TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    version TEXT,
+    enqueued REAL NOT NULL,
+    visible REAL NOT NULL,
+    leased INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS items_pending_key ON items (key) WHERE leased = 0;
+CREATE INDEX IF NOT EXISTS items_order ON items (priority, id);
+CREATE TABLE IF NOT EXISTS done (
+    key TEXT PRIMARY KEY,
+    version TEXT,
+    acked REAL
+);
+CREATE TABLE IF NOT EXISTS failed (
+    key TEXT PRIMARY KEY,
+    item TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    version TEXT,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    failed REAL NOT NULL
+);
+'''
+
+
+def _process_start( pid ):
+    '''Start time of process pid in clock ticks since boot, None where /proc is not available'''
+
+    try:
+        with open( '/proc/%d/stat' % pid ) as f:
+            # the command name in brackets may contain spaces
+            return f.read().rsplit( ')', 1 )[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def _owner():
+    '''Identifies this process, its pid and start time so a reused pid is not mistaken for it'''
+    return '%d:%s' % ( os.getpid(), _process_start( os.getpid() ) )
+
+
+def _alive( owner ):
+    try:
+        pid, start = owner.split( ':', 1 )
+        pid = int( pid )
+    except (AttributeError, ValueError):
+        return False
+
+    try:
+        os.kill( pid, 0 )
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return start == 'None' or _process_start( pid ) in (None, start)
+
+
+class DurableQueue:
+    '''Work queue persisted in a SQLite WAL database, so queued and in flight work survives restarts.'''
+    '''Consumers lease an item, then ack it when done or nack it to retry. A lease not acked within'''
+    '''visibility seconds makes the item available again. Items must be JSON serialisable.'''
+    '''put has the WorkQueue semantics: Priority order, pending keys collapse, blocking when full.'''
+    '''With a version, e.g. a file mtime and size, an item already acked at that version is skipped.'''
+    '''Acked versions are kept for done_keep seconds, after that the same version is accepted again.'''
+    '''An item that cannot be done is moved by fail to the failed items, where it stays, and further puts of its'''
+    '''key at the same version are skipped, until requeue.'''
+    '''Several processes may share the file: leases record their process and are only taken back early'''
+    '''from processes that have died'''
+
+    def __init__(self, path, maxsize=1000, visibility=300, synchronous='FULL', done_keep=30 * 24 * 3600):
+        self.path = str( path )
+        self.maxsize = maxsize
+        self.visibility = visibility
+        self.done_keep = done_keep
+
+        self._cond = threading.Condition()
+
+        self._db = sqlite3.connect( self.path, check_same_thread=False )
+        self._db.execute( 'PRAGMA journal_mode=WAL' )
+        self._db.execute( 'PRAGMA synchronous=%s' % synchronous )
+        self._db.executescript( _SCHEMA )
+
+        columns = [ row[1] for row in self._db.execute( 'PRAGMA table_info(items)' ) ]
+        if 'owner' not in columns:
+            with self._db:
+                self._db.execute( 'ALTER TABLE items ADD COLUMN owner TEXT' )
+
+        columns = [ row[1] for row in self._db.execute( 'PRAGMA table_info(done)' ) ]
+        if 'acked' not in columns:
+            with self._db:
+                self._db.execute( 'ALTER TABLE done ADD COLUMN acked REAL' )
+                self._db.execute( 'UPDATE done SET acked = ?', (time.time(),) )
+
+        self._expired = None
+        self._expire()
+
+        self.owner = _owner()
+
+        # leases of processes that died are available now, those of live ones when their visibility runs out
+        owners = [ row[0] for row in self._db.execute( 'SELECT DISTINCT owner FROM items WHERE leased = 1' ) ]
+        dead = [ owner for owner in owners if owner != self.owner and not _alive( owner ) ]
+
+        with self._db:
+            self._db.executemany( 'UPDATE items SET visible = ? WHERE leased = 1 AND owner IS ?'
+                                  , [ (time.time(), owner) for owner in dead ] )
+
+        self._puts = 0
+        self._collapsed = 0
+        self._full = 0
+        self._leases = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def close(self):
+        with self._cond:
+            self._db.close()
+
+    def _expire(self):
+        # at most hourly, so a long running ingestor does not keep every version it ever acked
+        now = time.time()
+
+        if self._expired is None or now - self._expired > 3600:
+            with self._db:
+                self._db.execute( 'DELETE FROM done WHERE acked < ?', (now - self.done_keep,) )
+
+            self._expired = now
+
+    def _pending(self):
+        return self._db.execute( 'SELECT COUNT(*) FROM items WHERE leased = 0' ).fetchone()[0]
+
+    def put(self, item, block=True, timeout=None, priority=Priority.LIVE, key=None, version=None):
+        key = str( item ) if key is None else key
+        payload = json.dumps( item, default=str )
+
+        with self._cond:
+            db = self._db
+
+            if version is not None:
+                row = db.execute( 'SELECT version FROM done WHERE key = ? UNION ALL '
+                                  'SELECT version FROM failed WHERE key = ?', (key, key) ).fetchall()
+                if (version,) in row:
+                    return
+
+            with db:
+                cursor = db.execute( 'UPDATE items SET item = ?, version = ?, priority = MIN(priority, ?) '
+                                     'WHERE key = ? AND leased = 0', (payload, version, int(priority), key) )
+
+            if cursor.rowcount:
+                self._collapsed += 1
+                return
+
+            if self._pending() >= self.maxsize:
+                self._full += 1
+
+                if not block:
+                    raise queue.Full
+
+                if not self._cond.wait_for( lambda: self._pending() < self.maxsize, timeout ):
+                    raise queue.Full
+
+            now = time.time()
+
+            with db:
+                db.execute( 'INSERT INTO items (key, item, priority, version, enqueued, visible) VALUES (?, ?, ?, ?, ?, ?)'
+                            , (key, payload, int(priority), version, now, now) )
+
+            self._puts += 1
+            self._cond.notify_all()
+
+    def _take(self):
+        now = time.time()
+
+        while True:
+            with self._db as db:
+                row = db.execute( 'SELECT id, key, item, attempts, enqueued, leased FROM items WHERE visible <= ? '
+                                  'ORDER BY priority, id LIMIT 1', (now,) ).fetchone()
+
+                if row is None:
+                    return None
+
+                _id, key, item, attempts, enqueued, leased = row
+
+                # only if no other process leased the row since the SELECT
+                cursor = db.execute( 'UPDATE items SET leased = 1, visible = ?, attempts = attempts + 1, owner = ? '
+                                     'WHERE id = ? AND visible <= ? AND attempts = ?'
+                                     , (now + self.visibility, self.owner, _id, now, attempts) )
+
+            if cursor.rowcount:
+                break
+
+        if not leased:
+            wait = now - enqueued
+            self._leases += 1
+            self._wait_total += wait
+            self._wait_max = max( self._wait_max, wait )
+
+            # a pending slot was freed
+            self._cond.notify_all()
+
+        return Lease( _id, key, json.loads( item ), attempts + 1 )
+
+    def lease(self, block=True, timeout=None):
+        '''Take the next visible item. Raises queue.Empty'''
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                lease = self._take()
+                if lease is not None:
+                    return lease
+
+                if not block:
+                    raise queue.Empty
+
+                remaining = 0.5 if deadline is None else min( 0.5, deadline - time.monotonic() )
+                if remaining <= 0:
+                    raise queue.Empty
+
+                # short waits as leases also become visible when they time out
+                self._cond.wait( remaining )
+
+    def ack(self, lease):
+        with self._cond:
+            with self._db as db:
+                row = db.execute( 'SELECT version FROM items WHERE id = ?', (lease.id,) ).fetchone()
+
+                db.execute( 'DELETE FROM items WHERE id = ?', (lease.id,) )
+
+                if row and row[0] is not None:
+                    db.execute( 'INSERT OR REPLACE INTO done (key, version, acked) VALUES (?, ?, ?)', (lease.key, row[0], time.time()) )
+
+            self._expire()
+
+    def nack(self, lease, delay=0):
+        '''Return a leased item to the queue, visible again after delay seconds'''
+
+        with self._cond:
+            with self._db as db:
+                try:
+                    db.execute( 'UPDATE items SET leased = 0, visible = ? WHERE id = ?', (time.time() + delay, lease.id) )
+                except sqlite3.IntegrityError:
+                    # a newer put of the same key is pending, that one wins
+                    db.execute( 'DELETE FROM items WHERE id = ?', (lease.id,) )
+
+            self._cond.notify_all()
+
+    def fail(self, lease, error=None):
+        '''Move a leased item to the failed items, it is not tried again until requeue'''
+
+        with self._cond:
+            with self._db as db:
+                row = db.execute( 'SELECT item, priority, version FROM items WHERE id = ?', (lease.id,) ).fetchone()
+
+                db.execute( 'DELETE FROM items WHERE id = ?', (lease.id,) )
+
+                if row:
+                    db.execute( 'INSERT OR REPLACE INTO failed (key, item, priority, version, attempts, error, failed) '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?)', (lease.key, *row, lease.attempts, None if error is None else str(error), time.time()) )
+
+    def failures(self):
+        '''[ { key, item, version, attempts, error, failed } ] of the failed items, oldest first'''
+
+        with self._cond:
+            rows = self._db.execute( 'SELECT key, item, version, attempts, error, failed FROM failed ORDER BY failed' ).fetchall()
+
+        return [ { 'key' : key, 'item' : json.loads( item ), 'version' : version, 'attempts' : attempts, 'error' : error, 'failed' : failed }
+                 for key, item, version, attempts, error, failed in rows ]
+
+    def requeue(self, key):
+        '''Put a failed item back on the queue, attempts counting from 0 again. False if key has not failed'''
+
+        with self._cond:
+            row = self._db.execute( 'SELECT item, priority, version FROM failed WHERE key = ?', (key,) ).fetchone()
+
+            if row is None:
+                return False
+
+            with self._db as db:
+                db.execute( 'DELETE FROM failed WHERE key = ?', (key,) )
+
+            item, priority, version = row
+
+        self.put( json.loads( item ), priority=Priority( priority ), key=key, version=version )
+
+        return True
+
+    def release(self):
+        '''Make every item leased by this process visible again, e.g. when shutting down'''
+
+        with self._cond:
+            with self._db as db:
+                db.execute( 'UPDATE items SET visible = ? WHERE leased = 1 AND owner = ?', (time.time(), self.owner) )
+
+            self._cond.notify_all()
+
+    def forget(self, key):
+        '''Drop the done record of key so the same version is accepted again'''
+
+        with self._cond:
+            with self._db as db:
+                db.execute( 'DELETE FROM done WHERE key = ?', (key,) )
+
+    def qsize(self):
+        with self._cond:
+            return self._pending()
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def metrics(self):
+        with self._cond:
+            depth = { p.name : 0 for p in Priority }
+
+            rows = self._db.execute( 'SELECT priority, COUNT(*) FROM items WHERE leased = 0 GROUP BY priority' )
+            for priority, count in rows:
+                depth[ Priority( priority ).name ] = count
+
+            in_flight = self._db.execute( 'SELECT COUNT(*) FROM items WHERE leased = 1' ).fetchone()[0]
+            failed = self._db.execute( 'SELECT COUNT(*) FROM failed' ).fetchone()[0]
+
+            return {
+                'depth' : sum( depth.values() ),
+                'depth_by_priority' : depth,
+                'in_progress' : in_flight,
+                'failed' : failed,
+                'puts' : self._puts,
+                'collapsed' : self._collapsed,
+                'full' : self._full,
+                'gets' : self._leases,
+                'wait_mean' : self._wait_total / self._leases if self._leases else 0.0,
+                'wait_max' : self._wait_max,
+            }
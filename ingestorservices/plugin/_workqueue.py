@@ -0,0 +1,163 @@
+import enum
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+
+class Priority( enum.IntEnum ):
+    INTERACTIVE = 0
+    LIVE = 1
+    BACKFILL = 2
+
+
+class _Entry:
+    __slots__ = ( 'item', 'priority', 'seq', 'enqueued' )
+
+    def __init__(self, item, priority, seq, enqueued):
+        self.item = item
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = enqueued
+
+
+class WorkQueue:
+    '''Bounded priority queue for plugin pipelines, a drop in for queue.Queue.'''
+    '''Items are taken in Priority order, then FIFO. Putting an item whose key is already pending'''
+    '''replaces the pending item rather than adding another (keeping the higher priority).'''
+    '''put blocks while maxsize items are pending. version is accepted for DurableQueue compatibility'''
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+
+        self._cond = threading.Condition()
+        self._all_done = threading.Condition( self._cond )
+
+        # (priority, seq, key). Entries superseded by a collapse are skipped on get
+        self._heap = []
+        self._pending = {}
+
+        self._seq = itertools.count()
+        self._unfinished = 0
+
+        self._puts = 0
+        self._collapsed = 0
+        self._full = 0
+        self._gets = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def put(self, item, block=True, timeout=None, priority=Priority.LIVE, key=None, version=None):
+        key = item if key is None else key
+
+        with self._cond:
+            if key not in self._pending and len( self._pending ) >= self.maxsize:
+                self._full += 1
+
+                if not block:
+                    raise queue.Full
+
+                # another producer may put the same key meanwhile, this item then replaces it
+                if not self._cond.wait_for( lambda: key in self._pending or len( self._pending ) < self.maxsize, timeout ):
+                    raise queue.Full
+
+            entry = self._pending.get( key )
+
+            if entry is not None:
+                entry.item = item
+                self._collapsed += 1
+
+                if priority < entry.priority:
+                    entry.priority = priority
+                    entry.seq = next( self._seq )
+                    heapq.heappush( self._heap, (priority, entry.seq, key) )
+                return
+
+            entry = _Entry( item, priority, next( self._seq ), time.monotonic() )
+
+            self._pending[ key ] = entry
+            heapq.heappush( self._heap, (priority, entry.seq, key) )
+
+            self._puts += 1
+            self._unfinished += 1
+
+            self._cond.notify_all()
+
+    def put_nowait(self, item, **kwargs):
+        return self.put( item, block=False, **kwargs )
+
+    def get(self, block=True, timeout=None):
+        with self._cond:
+            if not self._pending:
+                if not block:
+                    raise queue.Empty
+
+                if not self._cond.wait_for( lambda: self._pending, timeout ):
+                    raise queue.Empty
+
+            while True:
+                priority, seq, key = heapq.heappop( self._heap )
+
+                entry = self._pending.get( key )
+                if entry is not None and entry.seq == seq:
+                    break
+
+            del self._pending[ key ]
+
+            wait = time.monotonic() - entry.enqueued
+            self._gets += 1
+            self._wait_total += wait
+            self._wait_max = max( self._wait_max, wait )
+
+            # wake blocked producers
+            self._cond.notify_all()
+
+            return entry.item
+
+    def get_nowait(self):
+        return self.get( block=False )
+
+    def task_done(self):
+        with self._cond:
+            if self._unfinished <= 0:
+                raise ValueError( 'task_done() called too many times' )
+
+            self._unfinished -= 1
+
+            if self._unfinished == 0:
+                self._all_done.notify_all()
+
+    def join(self):
+        with self._all_done:
+            self._all_done.wait_for( lambda: self._unfinished == 0 )
+
+    def qsize(self):
+        with self._cond:
+            return len( self._pending )
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.maxsize
+
+    def metrics(self):
+        '''Depth (total and per priority), counters and queue wait times in seconds'''
+
+        with self._cond:
+            depth = { p.name : 0 for p in Priority }
+            for entry in self._pending.values():
+                depth[ Priority( entry.priority ).name ] += 1
+
+            return {
+                'depth' : len( self._pending ),
+                'depth_by_priority' : depth,
+                'in_progress' : self._unfinished - len( self._pending ),
+                'puts' : self._puts,
+                'collapsed' : self._collapsed,
+                'full' : self._full,
+                'gets' : self._gets,
+                'wait_mean' : self._wait_total / self._gets if self._gets else 0.0,
+                'wait_max' : self._wait_max,
+            }
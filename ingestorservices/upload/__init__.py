@@ -0,0 +1,4 @@
+from . _resilience import Backoff, CircuitBreaker, CircuitOpenError, is_transient
+from . _outbox import Outbox
+from . _uploader import Uploader, UploadDeferred, dataset_key
+from . _executor import UploadExecutor
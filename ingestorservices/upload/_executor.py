@@ -0,0 +1,149 @@
+import collections
+import logging
+import threading
+import time
+
+from concurrent.futures import Future
+
+logger = logging.getLogger( __name__ )
+
+
+class _Server:
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+
+        # owner -> deque of jobs, in round robin order
+        self.owners = collections.OrderedDict()
+
+    def runnable(self):
+        return self.owners and self.in_flight < self.limit
+
+    def take(self):
+        owner, jobs = self.owners.popitem( last=False )
+        job = jobs.popleft()
+
+        # the owner goes to the back of the line
+        if jobs:
+            self.owners[ owner ] = jobs
+
+        self.in_flight += 1
+
+        return job
+
+
+class UploadExecutor:
+    '''Runs uploads for every plugin on one pool of threads.'''
+    '''At most max_in_flight calls run against a server at once (see limit() to set it per server).'''
+    '''Jobs waiting for a server are taken round robin by owner, so a plugin with a large backlog'''
+    '''does not hold up the others. submit() returns a concurrent.futures.Future'''
+
+    def __init__(self, max_in_flight=4, max_workers=16):
+        self.max_in_flight = max_in_flight
+        self.max_workers = max_workers
+
+        self._cond = threading.Condition()
+        self._servers = {}
+        self._limits = {}
+        self._workers = []
+        self._idle = 0
+        self._shutdown = False
+
+    def limit(self, server, max_in_flight):
+        with self._cond:
+            self._limits[ server ] = max_in_flight
+
+            if server in self._servers:
+                self._servers[ server ].limit = max_in_flight
+
+            self._cond.notify_all()
+
+    def submit(self, server, owner, fn, *args, **kwargs):
+        '''fn( *args, **kwargs ) as a call to server on behalf of owner, owner defaulting to the calling thread'''
+
+        owner = threading.current_thread().name if owner is None else owner
+
+        future = Future()
+
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError( 'cannot submit after shutdown' )
+
+            s = self._servers.get( server )
+            if s is None:
+                s = self._servers[ server ] = _Server( self._limits.get( server, self.max_in_flight ) )
+
+            s.owners.setdefault( owner, collections.deque() ).append( (future, fn, args, kwargs) )
+
+            if not self._idle and len( self._workers ) < self.max_workers:
+                t = threading.Thread( target=self._work, name='UploadExecutor-%d' % len( self._workers ), daemon=True )
+                self._workers.append( t )
+                t.start()
+
+            self._cond.notify()
+
+        return future
+
+    def _next(self):
+        # servers also take turns, so one busy server does not starve another
+        for server, s in list( self._servers.items() ):
+            if s.runnable():
+                self._servers[ server ] = self._servers.pop( server )
+                return s, s.take()
+
+        return None, None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                self._idle += 1
+
+                s, job = self._next()
+                while job is None:
+                    if self._shutdown:
+                        self._idle -= 1
+                        return
+
+                    self._cond.wait()
+                    s, job = self._next()
+
+                self._idle -= 1
+
+            future, fn, args, kwargs = job
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result( fn( *args, **kwargs ) )
+                except BaseException as e:
+                    future.set_exception( e )
+
+            with self._cond:
+                s.in_flight -= 1
+                self._cond.notify_all()
+
+    def pending(self):
+        with self._cond:
+            return sum( len( jobs ) for s in self._servers.values() for jobs in s.owners.values() )
+
+    def shutdown(self, wait=True, timeout=None):
+        '''Finish queued jobs and stop the workers. Jobs still queued at the timeout are cancelled'''
+
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+            workers = list( self._workers )
+
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+
+            for t in workers:
+                t.join( None if deadline is None else max( 0, deadline - time.monotonic() ) )
+
+        with self._cond:
+            for s in self._servers.values():
+                for jobs in s.owners.values():
+                    for future, *_ in jobs:
+                        future.cancel()
+                s.owners.clear()
@@ -0,0 +1,97 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pending (
+    key TEXT PRIMARY KEY,
+    server TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS pending_server ON pending (server, created);
+CREATE TABLE IF NOT EXISTS sent (
+    key TEXT PRIMARY KEY,
+    pid TEXT,
+    sent REAL NOT NULL
+);
+'''
+
+
+class Outbox:
+    '''Serialized uploads waiting for their server to come back, in a SQLite file.'''
+    '''Entries are keyed so that a retried save replaces rather than duplicates its entry. Once an'''
+    '''entry is uploaded its pid is kept for keep seconds, so a later save of the same key returns it'''
+
+    def __init__(self, path, keep=30 * 24 * 3600):
+        self.path = str( path )
+
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect( self.path, check_same_thread=False )
+        self._db.execute( 'PRAGMA journal_mode=WAL' )
+        self._db.executescript( _SCHEMA )
+
+        with self._db:
+            self._db.execute( 'DELETE FROM sent WHERE sent < ?', (time.time() - keep,) )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def add(self, key, server, kind, payload):
+        with self._lock, self._db as db:
+            db.execute( 'INSERT INTO pending (key, server, kind, payload, created) VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT(key) DO UPDATE SET payload = excluded.payload, error = NULL'
+                        , (key, server, kind, json.dumps( payload ), time.time()) )
+
+    def pending(self, server=None, limit=100):
+        '''[(key, server, kind, payload)] oldest first, skipping entries the server rejected'''
+
+        sql = 'SELECT key, server, kind, payload FROM pending WHERE error IS NULL'
+        args = ()
+
+        if server is not None:
+            sql += ' AND server = ?'
+            args = (server,)
+
+        with self._lock:
+            rows = self._db.execute( sql + ' ORDER BY created LIMIT ?', args + (limit,) ).fetchall()
+
+        return [ (key, _server, kind, json.loads( payload )) for key, _server, kind, payload in rows ]
+
+    def is_pending(self, key):
+        with self._lock:
+            return self._db.execute( 'SELECT 1 FROM pending WHERE key = ? AND error IS NULL', (key,) ).fetchone() is not None
+
+    def sent(self, key):
+        '''pid recorded for key, or None'''
+
+        with self._lock:
+            row = self._db.execute( 'SELECT pid FROM sent WHERE key = ?', (key,) ).fetchone()
+
+        return row[0] if row else None
+
+    def mark_sent(self, key, pid):
+        with self._lock, self._db as db:
+            db.execute( 'DELETE FROM pending WHERE key = ?', (key,) )
+            db.execute( 'INSERT OR REPLACE INTO sent (key, pid, sent) VALUES (?, ?, ?)', (key, pid, time.time()) )
+
+    def mark_failed(self, key, error):
+        '''Keep an entry the server rejected for inspection, but stop sending it'''
+
+        with self._lock, self._db as db:
+            db.execute( 'UPDATE pending SET error = ?, attempts = attempts + 1 WHERE key = ?', (str(error), key) )
+
+    def retry(self, key):
+        with self._lock, self._db as db:
+            db.execute( 'UPDATE pending SET error = NULL WHERE key = ?', (key,) )
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute( 'SELECT COUNT(*) FROM pending WHERE error IS NULL' ).fetchone()[0]
@@ -0,0 +1,91 @@
+import random
+import threading
+import time
+
+import requests
+
+from .. client import ScicatServerError
+
+
+class CircuitOpenError( Exception ):
+    '''Raised instead of calling a server whose circuit is open'''
+
+    def __init__(self, server):
+        super().__init__( 'circuit open for %s' % server )
+        self.server = server
+
+
+def is_transient( e ):
+    '''True for failures worth retrying: no connection, timeouts and 5xx/429 responses'''
+
+    return isinstance( e, (requests.ConnectionError, requests.Timeout, ScicatServerError, CircuitOpenError) )
+
+
+class Backoff:
+    '''Exponential backoff with full jitter, delays are uniform in [0, min(cap, base * 2**attempt)]'''
+
+    def __init__(self, base=0.5, cap=60.0):
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt):
+        return random.uniform( 0, min( self.cap, self.base * 2 ** attempt ) )
+
+
+class CircuitBreaker:
+    '''Stops calls to a failing server.'''
+    '''After threshold consecutive failures the circuit opens and calls are refused for reset seconds.'''
+    '''It then half opens, letting a single probe through: success closes it, failure opens it again'''
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, reset=30.0):
+        self.threshold = threshold
+        self.reset = reset
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened = 0.0
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            self._update()
+            return self._state
+
+    def _update(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened >= self.reset:
+            self._state = self.HALF_OPEN
+            self._probing = False
+
+    def allow(self):
+        with self._lock:
+            self._update()
+
+            if self._state == self.CLOSED:
+                return True
+
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+
+            return False
+
+    def success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+
+            if self._state == self.HALF_OPEN or self._failures >= self.threshold:
+                self._state = self.OPEN
+                self._opened = time.monotonic()
+                self._probing = False
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import logging
+import threading
+
+logger = logging.getLogger( __name__ )
+
+from .. import core
+from .. import metadata
+
+from . _resilience import Backoff, CircuitBreaker, CircuitOpenError, is_transient
+
+
+class UploadDeferred( Exception ):
+    '''The upload could not be made now and is held in the outbox'''
+
+    def __init__(self, key, reason):
+        super().__init__( 'held in outbox as %s : %s' % (key, reason) )
+        self.key = key
+
+
+def dataset_key( ds ):
+    '''Key for a dataset from its content, for callers that have no natural key'''
+
+    payload = json.dumps( ds.model_dump( mode='json', exclude_none=True ), sort_keys=True )
+
+    return 'dataset:' + hashlib.sha256( payload.encode() ).hexdigest()
+
+
+class Uploader( threading.Thread ):
+    '''Makes uploads with jittered retries behind a circuit breaker per server.'''
+    '''Datasets that cannot be saved because their server is down are held in the outbox, and sent'''
+    '''in bulk by this thread once the breaker lets a probe through and it succeeds.'''
+    '''client is a callable returning the current MyMetadataClient, or None when logged out'''
+
+    def __init__(self, outbox, client, retries=2, backoff=None, threshold=5, reset=30.0, interval=5.0):
+        super().__init__( daemon=True )
+
+        self.outbox = outbox
+        self.client = client
+        self.retries = retries
+        self.backoff = backoff or Backoff()
+        self.threshold = threshold
+        self.reset = reset
+        self.interval = interval
+
+        self.evt_stop = threading.Event()
+        self.evt_wake = threading.Event()
+
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+        # (key, pid) for each outbox entry uploaded
+        self.sigSent = core.Signal()
+
+    def breaker(self, server):
+        with self._lock:
+            breaker = self._breakers.get( server )
+
+            if breaker is None:
+                breaker = self._breakers[ server ] = CircuitBreaker( self.threshold, self.reset )
+
+            return breaker
+
+    def call(self, server, fn, *args, retries=None, **kwargs):
+        '''fn( *args, **kwargs ), retrying transient failures. Raises CircuitOpenError while server is failing'''
+
+        breaker = self.breaker( server )
+        retries = self.retries if retries is None else retries
+
+        for attempt in range( retries + 1 ):
+            if not breaker.allow():
+                raise CircuitOpenError( server )
+
+            try:
+                res = fn( *args, **kwargs )
+
+            except Exception as e:
+                if not is_transient( e ):
+                    # the server answered, it is the request that is wrong
+                    breaker.success()
+                    raise
+
+                breaker.failure()
+
+                if attempt == retries or self.evt_stop.wait( self.backoff.delay( attempt ) ):
+                    raise
+
+                logger.info( 'retrying %s on %s : %s' % (fn.__name__, server, e) )
+
+            else:
+                breaker.success()
+                return res
+
+    def save_dataset(self, client, ds, key):
+        '''pid of the saved dataset. Raises UploadDeferred if it was put in the outbox instead'''
+
+        pid = self.outbox.sent( key )
+        if pid is not None:
+            return pid
+
+        server = client._base_url
+
+        # an earlier attempt is waiting in the outbox, it is sent from there
+        if self.outbox.is_pending( key ):
+            self.outbox.add( key, server, 'dataset', ds.model_dump( mode='json', exclude_none=True ) )
+            self.wake()
+            raise UploadDeferred( key, 'waiting for %s' % server )
+
+        try:
+            pid = self.call( server, client.upload_new_dataset, ds )
+
+        except Exception as e:
+            if not is_transient( e ):
+                raise
+
+            self.outbox.add( key, server, 'dataset', ds.model_dump( mode='json', exclude_none=True ) )
+            self.wake()
+            raise UploadDeferred( key, e )
+
+        self.outbox.mark_sent( key, pid )
+
+        return pid
+
+    def save_datablock(self, client, dataset_id, datablock, key=None):
+        '''id of the saved datablock. With a key a datablock already saved under it is not saved again'''
+
+        if key is not None:
+            datablock_id = self.outbox.sent( key )
+            if datablock_id is not None:
+                return datablock_id
+
+        res = self.call( client._base_url, client.upload_dataset_origdatablock, dataset_id, datablock )
+        datablock_id = res.get('id') if res else None
+
+        if key is not None and datablock_id is not None:
+            self.outbox.mark_sent( key, datablock_id )
+
+        return datablock_id
+
+    def drain(self, client, limit=100):
+        '''Send outbox entries for the client's server. Returns the number sent'''
+
+        server = client._base_url
+        count = 0
+
+        for key, _, kind, payload in self.outbox.pending( server, limit ):
+            try:
+                if kind == 'dataset':
+                    pid = self.call( server, client.upload_new_dataset, metadata.Dataset( **payload ), retries=0 )
+                else:
+                    raise ValueError( 'unknown outbox entry kind %s' % kind )
+
+            except Exception as e:
+                if is_transient( e ):
+                    break
+
+                logger.error( 'outbox entry %s rejected : %s' % (key, e) )
+                self.outbox.mark_failed( key, e )
+                continue
+
+            self.outbox.mark_sent( key, pid )
+            self.sigSent.emit( key, pid )
+
+            count += 1
+
+        return count
+
+    def wake(self):
+        with self._lock:
+            if self.ident is None:
+                self.start()
+
+        self.evt_wake.set()
+
+    def stop(self):
+        self.evt_stop.set()
+        self.evt_wake.set()
+
+    def run(self):
+        while not self.evt_stop.is_set():
+
+            client = self.client()
+
+            try:
+                while client is not None and len( self.outbox ) and self.drain( client ):
+                    pass
+            except Exception as e:
+                logger.exception( e )
+
+            self.evt_wake.wait( timeout=self.interval )
+            self.evt_wake.clear()
@@ -0,0 +1,293 @@
+import fnmatch
+import logging
+import os
+import pathlib
+import queue
+import threading
+import time
+
+logger = logging.getLogger( __name__ )
+
+from .. plugin import Priority
+
+# watchdog is optional. When installed its close-write events release
+# completed files without waiting for the settle time to pass
+try:
+    import watchdog.observers
+    import watchdog.events
+except ImportError:
+    watchdog = None
+
+
+class StabilityTracker:
+    '''Holds back files that are still being written.'''
+    '''A path is ready once its (mtime, size) has not changed for settle seconds, or once a'''
+    '''close-write event has been seen for it.'''
+
+    def __init__(self, settle):
+        self.settle = settle
+
+        # path -> [version, monotonic time of last change, closed]
+        self._pending = {}
+
+        # close-write events for paths not scanned yet
+        self._closed = set()
+
+    def __len__(self):
+        return len( self._pending )
+
+    def observe(self, path, version, now):
+        entry = self._pending.get( path )
+
+        if entry is None:
+            # files untouched for longer than settle, e.g. found at start up, are ready now
+            age = time.time() - version[0] / 1e9
+            since = now - age if age >= self.settle else now
+
+            self._pending[ path ] = [ version, since, path in self._closed ]
+            self._closed.discard( path )
+
+        elif entry[0] != version:
+            entry[0] = version
+            entry[1] = now
+
+    def closed(self, path):
+        entry = self._pending.get( path )
+
+        if entry is not None:
+            entry[2] = True
+        else:
+            self._closed.add( path )
+
+    def discard(self, path):
+        self._pending.pop( path, None )
+
+    def prune(self, found):
+        for path in [ p for p in self._pending if p not in found ]:
+            del self._pending[ path ]
+
+        self._closed.intersection_update( found )
+
+    def ready(self, now):
+        return [ (path, entry[0]) for path, entry in self._pending.items()
+                 if entry[2] or now - entry[1] >= self.settle ]
+
+
+class Subscription:
+    '''A root directory and relative glob (e.g. */*.md) whose matches are put on q.'''
+    '''With settle > 0 a file is only delivered once it has stopped changing'''
+
+    def __init__(self, root, pattern, q, settle=0):
+        self.root = pathlib.Path( root )
+        self.pattern = pattern
+        self.parts = pathlib.PurePath( pattern ).parts
+        self.q = q
+
+        self.tracker = StabilityTracker( settle ) if settle > 0 else None
+
+        # path -> (st_mtime_ns, st_size) of the last delivered version
+        self.seen = {}
+
+        # files found by the first pass were there before we started
+        self.backfill = True
+
+
+if watchdog is not None:
+
+    class _CloseWriteHandler( watchdog.events.FileSystemEventHandler ):
+
+        def __init__(self, watcher):
+            super().__init__()
+            self.watcher = watcher
+
+        def on_closed(self, evt):
+            self.watcher._closed( pathlib.Path( evt.src_path ) )
+
+
+class FileWatcher( threading.Thread ):
+    '''Scans the directories of all subscriptions from a single thread.'''
+    '''Each directory is listed once per pass however many subscriptions cover it, and a file is'''
+    '''delivered to a subscriber once per (mtime, size) version.'''
+
+    def __init__(self, interval=1.0):
+        super().__init__( daemon=True )
+
+        self.interval = interval
+
+        self.evt_stop = threading.Event()
+        self.evt_wake = threading.Event()
+
+        self._lock = threading.Lock()
+        self._subscriptions = []
+
+        self._observer = None
+        self._watches = {}
+
+    def subscribe(self, root, pattern, q, settle=0):
+        subscription = Subscription( root, pattern, q, settle=settle )
+
+        with self._lock:
+            self._subscriptions.append( subscription )
+
+            if self.ident is None:
+                self.start()
+
+            if subscription.tracker is not None:
+                self._watch( subscription.root )
+
+        self.wake()
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove( subscription )
+
+    def _watch(self, root):
+        '''One observer for the host, one watch per root. Only used for close-write events'''
+
+        if watchdog is None or root in self._watches:
+            return
+
+        try:
+            if self._observer is None:
+                self._observer = watchdog.observers.Observer()
+                self._observer.daemon = True
+                self._observer.start()
+
+            self._watches[ root ] = self._observer.schedule( _CloseWriteHandler( self ), str(root), recursive=True )
+
+        except Exception as e:
+            logger.warning( 'close-write events unavailable for %s : %s' % (root, e) )
+
+    def _closed(self, path):
+        with self._lock:
+            for subscription in self._subscriptions:
+                if subscription.tracker is not None:
+                    subscription.tracker.closed( path )
+
+        self.wake()
+
+    def forget(self, path):
+        '''Deliver path again on the next pass, e.g. after a failed ingest'''
+
+        path = pathlib.Path( path )
+
+        with self._lock:
+            for subscription in self._subscriptions:
+                subscription.seen.pop( path, None )
+
+                if subscription.tracker is not None:
+                    subscription.tracker.discard( path )
+
+    def wake(self):
+        self.evt_wake.set()
+
+    def stop(self):
+        self.evt_stop.set()
+        self.evt_wake.set()
+
+        if self._observer is not None:
+            self._observer.stop()
+
+    def run(self):
+        while not self.evt_stop.is_set():
+
+            try:
+                self.scan()
+            except Exception as e:
+                logger.exception( e )
+
+            self.evt_wake.wait( timeout=self.interval )
+            self.evt_wake.clear()
+
+    def scan(self):
+        with self._lock:
+            subscriptions = list( self._subscriptions )
+
+        # directory -> DirEntry list, shared by all subscriptions for this pass
+        listings = {}
+
+        for subscription in subscriptions:
+            found = dict( self._glob( listings, subscription.root, subscription.parts ) )
+
+            with self._lock:
+                self._deliver( subscription, found )
+
+            subscription.backfill = False
+
+    def _list(self, listings, directory):
+        entries = listings.get( directory )
+
+        if entries is None:
+            try:
+                with os.scandir( directory ) as it:
+                    entries = list( it )
+            except OSError:
+                entries = []
+
+            listings[ directory ] = entries
+
+        return entries
+
+    def _glob(self, listings, directory, parts):
+        head, tail = parts[0], parts[1:]
+
+        for entry in self._list( listings, str(directory) ):
+
+            if not fnmatch.fnmatch( entry.name, head ):
+                continue
+
+            try:
+                if tail:
+                    if entry.is_dir():
+                        yield from self._glob( listings, entry.path, tail )
+
+                elif entry.is_file():
+                    st = entry.stat()
+                    yield pathlib.Path( entry.path ), (st.st_mtime_ns, st.st_size)
+
+            except OSError:
+                pass
+
+    def _deliver(self, subscription, found):
+        seen = subscription.seen
+        tracker = subscription.tracker
+
+        # forget vanished files so that a re-created file is delivered again
+        for path in [ p for p in seen if p not in found ]:
+            del seen[ path ]
+
+        if tracker is not None:
+            now = time.monotonic()
+
+            tracker.prune( found )
+
+            for path, version in found.items():
+                if seen.get( path ) != version:
+                    tracker.observe( path, version, now )
+
+            found = dict( tracker.ready( now ) )
+
+        for path in sorted( found ):
+            version = found[ path ]
+
+            if seen.get( path ) == version:
+                continue
+
+            try:
+                if isinstance( subscription.q, queue.Queue ):
+                    subscription.q.put( path, block=False )
+                else:
+                    priority = Priority.BACKFILL if subscription.backfill else Priority.LIVE
+                    subscription.q.put( path, block=False, priority=priority, version='%d:%d' % version )
+
+                seen[ path ] = version
+
+                if tracker is not None:
+                    tracker.discard( path )
+
+            except queue.Full:
+                # leave unseen, it is offered again on the next pass
+                break
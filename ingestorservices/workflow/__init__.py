@@ -0,0 +1,3 @@
+from . _runner import Workflow, Step, StepResult, StepSkipped
+from . _memo import MemoStore, step_digest
+from . _artifacts import ArtifactStore
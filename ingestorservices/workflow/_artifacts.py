@@ -0,0 +1,61 @@
+import json
+import os
+import pathlib
+import shutil
+import time
+import urllib.parse
+
+from . _runner import StepResult
+
+
+class ArtifactStore:
+    '''Step results on local disk, one directory per run id and one file per step.'''
+    '''A step publishes what it saved, dependents read it back without asking the catalog,'''
+    '''including steps run later in another process. Runs older than keep seconds are removed'''
+
+    def __init__(self, path, keep=7 * 24 * 3600):
+        self.path = pathlib.Path( path )
+        self.path.mkdir( parents=True, exist_ok=True )
+
+        self.prune( keep )
+
+    def _run_dir(self, run):
+        # run ids come from the command line, keep them to one path component
+        return self.path / urllib.parse.quote( str(run), safe='' )
+
+    def _file(self, run, step):
+        return self._run_dir( run ) / ('%s.json' % urllib.parse.quote( step, safe='' ))
+
+    def publish(self, run, step, pid, dataset=None):
+        path = self._file( run, step )
+        path.parent.mkdir( exist_ok=True )
+
+        tmp = path.with_suffix( '.tmp' )
+        with open( tmp, 'w' ) as f:
+            json.dump( { 'pid' : pid, 'dataset' : dataset }, f, default=str )
+
+        os.replace( tmp, path )
+
+    def get(self, run, step):
+        '''StepResult published by step in run, or None'''
+
+        try:
+            with open( self._file( run, step ), 'r' ) as f:
+                j = json.load( f )
+        except (OSError, ValueError):
+            return None
+
+        return StepResult( j['pid'], j['dataset'] )
+
+    def discard(self, run):
+        shutil.rmtree( self._run_dir( run ), ignore_errors=True )
+
+    def prune(self, keep):
+        cutoff = time.time() - keep
+
+        for path in self.path.iterdir():
+            try:
+                if path.stat().st_mtime < cutoff:
+                    shutil.rmtree( path, ignore_errors=True )
+            except OSError:
+                pass
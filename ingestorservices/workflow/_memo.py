@@ -0,0 +1,108 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+CHUNK_SIZE = 1 << 20
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS memo (
+    digest TEXT PRIMARY KEY,
+    step TEXT NOT NULL,
+    pid TEXT NOT NULL,
+    dataset TEXT,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS memo_used ON memo (used);
+'''
+
+
+def file_digest( path ):
+    h = hashlib.sha256()
+
+    with open( path, 'rb' ) as f:
+        for chunk in iter( lambda: f.read( CHUNK_SIZE ), b'' ):
+            h.update( chunk )
+
+    return h.hexdigest()
+
+
+def step_digest( step, kwargs, upstream ):
+    '''Digest of everything a step's output depends on: its plugin, kwargs, upstream pids and input files'''
+
+    inputs = {
+        'step' : step.name,
+        'plugin' : step.plugin,
+        'kwargs' : kwargs,
+        'upstream' : { name : result.pid for name, result in upstream.items() },
+        'files' : { str(path) : file_digest( path ) for path in step.inputs },
+    }
+
+    return hashlib.sha256( json.dumps( inputs, sort_keys=True, default=str ).encode() ).hexdigest()
+
+
+class MemoStore:
+    '''Step results by input digest in a SQLite file, least recently used evicted past max_bytes'''
+
+    def __init__(self, path, max_bytes=64 << 20):
+        self.path = str( path )
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect( self.path, check_same_thread=False )
+        self._db.executescript( _SCHEMA )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, digest):
+        '''(pid, dataset) recorded for digest, or None'''
+
+        with self._lock, self._db as db:
+            row = db.execute( 'SELECT pid, dataset FROM memo WHERE digest = ?', (digest,) ).fetchone()
+
+            if row is None:
+                return None
+
+            db.execute( 'UPDATE memo SET used = ? WHERE digest = ?', (time.time(), digest) )
+
+        pid, dataset = row
+
+        return pid, json.loads( dataset ) if dataset is not None else None
+
+    def put(self, digest, step, pid, dataset):
+        payload = json.dumps( dataset, default=str ) if dataset is not None else None
+        size = len( digest ) + len( pid ) + len( payload or '' )
+
+        with self._lock, self._db as db:
+            db.execute( 'INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?, ?, ?)'
+                        , (digest, step, pid, payload, size, time.time()) )
+
+            self._evict( db )
+
+    def _evict(self, db):
+        total = db.execute( 'SELECT COALESCE(SUM(size), 0) FROM memo' ).fetchone()[0]
+
+        if total <= self.max_bytes:
+            return
+
+        rows = db.execute( 'SELECT digest, size FROM memo ORDER BY used' ).fetchall()
+
+        evicted = []
+        for digest, size in rows:
+            if total <= self.max_bytes:
+                break
+
+            evicted.append( (digest,) )
+            total -= size
+
+        db.executemany( 'DELETE FROM memo WHERE digest = ?', evicted )
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute( 'SELECT COUNT(*) FROM memo' ).fetchone()[0]
@@ -0,0 +1,172 @@
+import logging
+import threading
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger( __name__ )
+
+from .. import core
+
+from . _memo import MemoStore, step_digest
+
+log_decorator = core.create_logger_decorator( logger )
+
+
+Step = namedtuple( 'Step', ['name', 'path', 'plugin', 'depends', 'inputs', 'memo', 'kwargs'] )
+
+# what a step hands to its dependents, returned from the plugin's run()
+StepResult = namedtuple( 'StepResult', ['pid', 'dataset'] )
+
+
+class StepSkipped( Exception ):
+    '''A dependency of the step failed'''
+
+
+class Workflow:
+    '''Step plugins run in this process as a DAG.'''
+    '''Each plugin path is loaded once. A step starts when all its dependencies have finished, steps'''
+    '''that do not depend on each other run in parallel, and each step receives the StepResults of'''
+    '''its dependencies as initialise( upstream={ name : StepResult } ).'''
+    '''A step whose kwargs, upstream pids and input files match an earlier run is not run again, the'''
+    '''recorded StepResult is reused. Pass memo=None to always run'''
+
+    def __init__(self, host_services, max_workers=None, memo=True):
+        self.host_services = host_services
+        self.max_workers = max_workers
+
+        if memo is True:
+            memo = MemoStore( host_services.state_dir( 'workflow' ) / 'memo.sqlite' )
+
+        self.memo = memo
+        self.steps = {}
+
+    def add(self, name, path, plugin=None, depends=(), inputs=(), memo=True, **kwargs):
+        '''plugin is the label the plugin registers, needed when path holds more than one.'''
+        '''inputs are the files the step reads, hashed for memoization. memo=False always runs the step.'''
+        '''Dependencies must be added first, which keeps the graph acyclic'''
+
+        if name in self.steps:
+            raise ValueError( 'Duplicate step %s' % name )
+
+        for d in depends:
+            if d not in self.steps:
+                raise ValueError( 'Step %s depends on unknown step %s' % (name, d) )
+
+        self.steps[ name ] = Step( name, path, plugin, tuple( depends ), tuple( inputs ), memo, kwargs )
+
+        return self
+
+    @log_decorator
+    def load(self):
+        '''{ step name : plugin instance }, importing each path once'''
+
+        host_services = self.host_services
+
+        registered = {}
+        plugins = {}
+
+        for step in self.steps.values():
+
+            if step.path not in registered:
+                before = set( host_services.plugins )
+                host_services.load_plugins( paths=[ step.path ] )
+                registered[ step.path ] = [ label for label in host_services.plugins if label not in before ]
+
+            labels = registered[ step.path ]
+
+            if step.plugin is not None:
+                if step.plugin not in host_services.plugins:
+                    raise ValueError( 'No plugin %s for step %s' % (step.plugin, step.name) )
+                plugins[ step.name ] = host_services.plugins[ step.plugin ]
+
+            elif len( labels ) == 1:
+                plugins[ step.name ] = host_services.plugins[ labels[0] ]
+
+            else:
+                raise ValueError( 'Step %s must name one of the plugins %s' % (step.name, labels) )
+
+        return plugins
+
+    def _run_step(self, plugin, lock, step, upstream, kwargs):
+        kwargs = { **kwargs, **step.kwargs }
+
+        digest = None
+
+        # an upstream without a pid was not saved, so its output is unknown
+        if self.memo is not None and step.memo and all( r.pid for r in upstream.values() ):
+            digest = step_digest( step, kwargs, upstream )
+
+            hit = self.memo.get( digest )
+            if hit is not None:
+                self.host_services.log( 'Step %s unchanged, reusing %s' % (step.name, hit[0]) )
+                return StepResult( *hit )
+
+        # steps sharing a plugin instance take turns
+        with lock:
+            plugin.initialise( **kwargs, upstream=upstream )
+
+            result = plugin.run()
+
+        if not isinstance( result, StepResult ):
+            return StepResult( None, None )
+
+        if digest is not None and result.pid:
+            self.memo.put( digest, step.name, result.pid, result.dataset )
+
+        return result
+
+    @log_decorator
+    def run(self, **kwargs):
+        '''Run all steps, kwargs (e.g. run=1) go to every step. Returns { name : StepResult or exception }'''
+
+        host_services = self.host_services
+
+        plugins = self.load()
+        locks = { id(plugin) : threading.Lock() for plugin in plugins.values() }
+
+        results = {}
+        pending = dict( self.steps )
+        running = {}
+
+        with ThreadPoolExecutor( max_workers=self.max_workers ) as executor:
+
+            while pending or running:
+
+                for name, step in list( pending.items() ):
+                    if any( d not in results for d in step.depends ):
+                        continue
+
+                    del pending[ name ]
+
+                    failed = [ d for d in step.depends if not isinstance( results[ d ], StepResult ) ]
+                    if failed:
+                        results[ name ] = StepSkipped( 'Step %s skipped, %s failed' % (name, failed) )
+                        host_services.log( results[ name ] )
+                        continue
+
+                    upstream = { d : results[ d ] for d in step.depends }
+                    plugin = plugins[ name ]
+
+                    host_services.log( 'Step %s started' % name )
+                    future = executor.submit( self._run_step, plugin, locks[ id(plugin) ], step, upstream, kwargs )
+                    running[ future ] = name
+
+                if not running:
+                    # only skips this pass, look again for steps they unblocked
+                    continue
+
+                done, _ = wait( running, return_when=FIRST_COMPLETED )
+
+                for future in done:
+                    name = running.pop( future )
+
+                    try:
+                        results[ name ] = future.result()
+                        host_services.log( 'Step %s finished : %s' % (name, results[ name ].pid) )
+                    except Exception as e:
+                        logger.exception( e )
+                        results[ name ] = e
+                        host_services.log( 'Step %s failed : %s' % (name, e) )
+
+        return results
@@ -6,6 +6,8 @@ import json
 import logging
 import shutil
 
+from plugins.examplePlugin.validate import validate_bag, BagValidationError
+
 logger = logging.getLogger( __name__ )
 
 import ingestorservices as services
@@ -21,115 +23,53 @@ import threading
 import queue
 import pathlib
 
-#import watchdog.observers
-#import watchdog.events
-
-
-class WorkerBase( threading.Thread):
-    def __init__(self):
-        super().__init__()
-        self.evt_stop = threading.Event()
-
-    def stop(self):
-        self.evt_stop.set()
-
-
-class RetryWorker( WorkerBase ):
-    '''Periodically check for bagit files in spool path'''
-
-    def __init__(self, path, q_out):
-
-        super().__init__()
-
-        self.root = path
-        self.q_out = q_out
-
-
-    def run(self):
-        while not self.evt_stop.wait(timeout=1):
-
-            try:
-               paths = self.root.glob( './*/bagit.txt') 
-
-               for path in sorted(paths):
-                   self.q_out.put( path )
-
-            except Exception as e:
-                print(e)
-
-
-
-class Producer( WorkerBase ):
-    ''' Generate trigger events using the RetryWorker and the MyHandler '''
-
-    def __init__(self, q, path_spool = '/tmp/spool'):
-        super().__init__()
-
-        self.signal = core.Signal()
-        self.count = 0
-        self.q = q
-        self.path_spool = pathlib.Path( path_spool )
-
-    def run(self):
-
-        path =  self.path_spool / 'bags' 
-        path.mkdir( parents=True, exist_ok=True)
-
-        retry_worker = RetryWorker( path, self.q )
-        retry_worker.start()
-
-        while not self.evt_stop.wait(timeout=1):
-            pass
-
-        retry_worker.stop() 
-        retry_worker.join()
-
-    def onNewBagit(self, path):
-        self.q.put( path )
-
-class Consumer( WorkerBase ):
-    '''Recieve event paths '''
-
-    def __init__(self, q_in ):
-
-        super().__init__()
-        self.q_in = q_in
-        self.count = 0
-
-        self.sigDataAvailable = core.Signal()
-
-    def run(self):
-            while not self.evt_stop.wait(timeout=1):
-                                     
-                self.count += 1
-
-                try:
-                    res = self.q_in.get( block=True, timeout=0.2)
-                    
-                    self.sigDataAvailable.emit( res )
-
-                    self.q_in.task_done()
-                except queue.Empty:
-                    pass
-
 
 class ExamplePlugin( ingestorservices.plugin.PluginBase ):
     '''Wait for bagit events. Extract metadata from placeholder and bagit file before writing to backend '''
 
+    # seconds bagit.txt must be unchanged before the bag is looked at
+    SETTLE = 5.0
+
+    # attempts at a bag before it is set aside as failed, e.g. when corrupt
+    MAX_ATTEMPTS = 5
+
     def __init__(self, host_services):
         super().__init__(host_services)
 
         self.path_spool  = pathlib.Path('/tmp/spool')
 
-        self.q = queue.Queue()
-        
-        self.producer = Producer(self.q)
-
-        self.consumer = Consumer( self.q )
+        # Create an Ownable that will get reused for several other Model objects
+        ownable = metadata.Ownable(ownerGroup="magrathea", accessGroups=["deep_though"], createdBy=None, updatedBy=None, updatedAt=None, createdAt=None, instrumentGroup=None)
+
+        # fields common to every bag's dataset, validated once
+        self.datasets = metadata.DatasetBuilder(
+                owner="slartibartfast",
+                contactEmail="slartibartfast@magrathea.org",
+                creationLocation= 'magrathea',
+                type="raw",
+                instrumentId="earth",
+                proposalId="deepthought",
+                dataFormat="planet",
+                principalInvestigator="A. Mouse",
+                sampleId="gargleblaster",
+                version='1',
+                **ownable.dict())
+
+        # queued bags survive a restart of the ingestor
+        self.q = ingestorservices.plugin.DurableQueue( host_services.state_dir( 'queues' ) / '%s.sqlite' % type(self).__name__ )
+
+        self.consumer = ingestorservices.plugin.Consumer( self.q, max_attempts=self.MAX_ATTEMPTS )
         self.consumer.sigDataAvailable.connect( self.onDataAvailable )
+        self.consumer.start()
 
-        for t in [self.consumer, self.producer]:
-            t.start()
+        path_bags = self.path_spool / 'bags'
+        path_bags.mkdir( parents=True, exist_ok=True)
+
+        # payloads of ingested bags, where their datasets' sourceFolder points
+        self.path_archive = self.path_spool / 'archive'
+        self.path_archive.mkdir( parents=True, exist_ok=True)
+
+        self.subscription = host_services.watcher.subscribe( path_bags, '*/bagit.txt', self.q, settle=self.SETTLE )
 
         def requireProperty( name, value ):
 
@@ -177,18 +117,21 @@ class ExamplePlugin( ingestorservices.plugin.PluginBase ):
         w.setLayout( vbox )
 
     def run(self):
-        self.producer.join()
         self.consumer.join()
 
 
     def stop(self):
-        self.producer.stop()
-        self.consumer.stop()
+        self.host_services.watcher.unsubscribe( self.subscription )
 
-        self.producer.join()
+        self.consumer.stop()
         self.consumer.join()
 
 
+    def drain(self, deadline):
+        self.host_services.watcher.unsubscribe( self.subscription )
+
+        return self.consumer.drain( deadline )
+
     def widget(self):
         print(self.w)
         return self.w
@@ -244,6 +187,15 @@ class ExamplePlugin( ingestorservices.plugin.PluginBase ):
 
             self.log( 'bagit path : %s' % path )
 
+            report = validate_bag( path )
+
+            if not report.valid:
+                # the bag may still be arriving, the consumer retries it with backoff rather than marking it done
+                self.log( 'Invalid bag %s : %s' % (path, report.error) )
+                raise BagValidationError( 'Invalid bag %s : %s' % (path, report.error) )
+
+            self.log( 'Validated %d files, %d bytes in %.2fs (%.1f MB/s)' % (report.files, report.bytes, report.seconds, report.throughput) )
+
             try:
 
                 with open( path/'data/data.json', 'r' ) as f:
@@ -293,47 +245,57 @@ class ExamplePlugin( ingestorservices.plugin.PluginBase ):
 
             self.log( j_sm )
 
-            # Create an Ownable that will get reused for several other Model objects
-            ownable = metadata.Ownable(ownerGroup="magrathea", accessGroups=["deep_though"], createdBy=None, updatedBy=None, updatedAt=None, createdAt=None, instrumentGroup=None)
-
             name = 'bob'
 
-            print('SSSSSS')
-            ownable_dict = ownable.dict()
-            print('FFFFFFf')
+            # payload files were hashed by validate_bag, reuse its verified digests rather than reading them again
+            algorithms = set.intersection( *( set( d ) for d in report.digests.values() ) )
+            algorithm = 'md5' if 'md5' in algorithms else sorted( algorithms )[0]
+
+            # only the payload is the dataset, not the bag's tag files. Manifest paths start with data/
+            payload = path / 'data'
+            digests = { rel[ len('data/') : ] : d[ algorithm ] for rel, d in report.digests.items() }
+
+            inventory = metadata.DatablockBuilder( checksum=algorithm, cache_path=self.path_spool / 'checksums.sqlite' ).inventory( payload, checksums=digests )
 
-            dataset = metadata.Dataset(
-                    path='/foo/bar',
+            # the payload is moved here once ingested, the bag itself is removed
+            archived = self.path_archive / path.name
+
+            dataset = self.datasets.build(
                     datasetName=str(name),
-                    size=42,
-                    owner="slartibartfast",
-                    contactEmail="slartibartfast@magrathea.org",
-                    creationLocation= 'magrathea',
+                    size=inventory.size,
+                    numberOfFiles=len(inventory),
                     creationTime=str(datetime.datetime.now()),
-                    type="raw",
-                    instrumentId="earth",
-                    proposalId="deepthought",
-                    dataFormat="planet",
-                    principalInvestigator="A. Mouse",
-                    sourceFolder='/foo/bar',
-                    scientificMetadata= j_sm,
-                    sampleId="gargleblaster",
-                    version='1'
-                    ,validatationStatus=1
-                    ,**ownable.dict())
+                    sourceFolder=str(archived),
+                    scientificMetadata= j_sm )
 
             print('TRY1', name, dataset, host_services)
-            dataset_id = host_services.requestDatasetSave( dataset )
+            # keyed by bag version, so a retry while the dataset waits in the outbox does not save it twice
+            key = 'bag:%s:%d' % (bagit_path, bagit_path.stat().st_mtime_ns)
+            dataset_id = host_services.requestDatasetSave( dataset, key=key ).result()
 
             print('TRY2', dataset_id)
 
-            if dataset_id:
-                shutil.rmtree( bagit_path.parent )
+            if not dataset_id:
+                # the consumer puts the bag back on the queue to retry, by then it may have left the outbox
+                raise RuntimeError( 'Dataset save failed for %s' % path )
+
+            # datablocks upload side by side, each keyed by its place in the bag so a retry sends only those that failed
+            futures = [ host_services.requestDatablockSave( dataset_id, datablock, key='%s:block:%d' % (key, i) )
+                        for i, datablock in enumerate( inventory.datablocks() ) ]
+
+            failed = [ future for future in futures if not future.result() ]
+
+            if failed:
+                # keep the bag, the retry finds the dataset and the saved datablocks by their keys
+                raise RuntimeError( '%d of %d datablock saves failed for %s' % (len(failed), len(futures), path) )
 
-                try:
-                    placeholder_path.unlink()
-                except:
-                    pass
+            payload.rename( archived )
+            shutil.rmtree( path )
+
+            try:
+                placeholder_path.unlink()
+            except:
+                pass
 
 
 class Factory:
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import pathlib
+import threading
+import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+# bytes read per file per step. hashlib releases the GIL for large updates
+# so several files are hashed concurrently
+CHUNK_SIZE = 1 << 20
+
+
+class BagValidationError( Exception ):
+    pass
+
+
+class BagReport( namedtuple( 'BagReport', ['valid', 'files', 'bytes', 'seconds', 'error', 'digests'], defaults=(None,) ) ):
+    '''digests, of a valid bag, maps payload paths relative to the bag to { algorithm : verified digest }'''
+
+    @property
+    def throughput(self):
+        '''MB/s of payload hashed'''
+        return self.bytes / self.seconds / 1e6 if self.seconds else 0.0
+
+
+def _decode_path( s ):
+    # bagit percent encodes CR, LF and % in manifest paths
+    return s.replace( '%0A', '\n' ).replace( '%0D', '\r' ).replace( '%25', '%' )
+
+
+def _read_manifests( bag_path ):
+    '''{ relative path : { algorithm : digest } } for all manifest-<alg>.txt'''
+
+    entries = {}
+
+    for manifest in sorted( bag_path.glob( 'manifest-*.txt' ) ):
+        algorithm = manifest.stem[ len('manifest-'): ]
+
+        if algorithm not in hashlib.algorithms_available:
+            raise BagValidationError( 'Unsupported manifest algorithm %s' % algorithm )
+
+        with open( manifest, 'r', encoding='utf-8' ) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+
+                digest, path = line.split( None, 1 )
+                entries.setdefault( _decode_path( path.strip() ), {} )[ algorithm ] = digest.lower()
+
+    return entries
+
+
+def _read_oxum( bag_path ):
+    '''(octets, file count) from the Payload-Oxum in bag-info.txt, if any'''
+
+    try:
+        with open( bag_path / 'bag-info.txt', 'r', encoding='utf-8' ) as f:
+            for line in f:
+                key, _, value = line.partition( ':' )
+                if key.strip().lower() == 'payload-oxum':
+                    octets, count = value.strip().split( '.' )
+                    return int(octets), int(count)
+    except FileNotFoundError:
+        pass
+
+    return None
+
+
+def _hash_file( path, expected, chunk_size, evt_abort ):
+    hashers = { algorithm : hashlib.new( algorithm ) for algorithm in expected }
+
+    buf = bytearray( chunk_size )
+    view = memoryview( buf )
+
+    with open( path, 'rb', buffering=0 ) as f:
+        while not evt_abort.is_set():
+            n = f.readinto( buf )
+            if not n:
+                break
+
+            for h in hashers.values():
+                h.update( view[:n] )
+        else:
+            # another file failed, give up without a verdict
+            return
+
+    for algorithm, h in hashers.items():
+        if h.hexdigest() != expected[ algorithm ]:
+            evt_abort.set()
+            raise BagValidationError( '%s checksum mismatch for %s' % (algorithm, path) )
+
+
+def validate_bag( bag_path, workers=None, chunk_size=CHUNK_SIZE ):
+    '''Check a bag for completeness and verify every payload checksum.'''
+    '''Files are streamed through hashlib on a thread pool, each file read once for all manifests.'''
+    '''Stops at the first mismatch. Returns a BagReport'''
+
+    bag_path = pathlib.Path( bag_path )
+    start = time.perf_counter()
+
+    def report( valid, files=0, size=0, error=None, digests=None ):
+        return BagReport( valid, files, size, time.perf_counter() - start, error, digests )
+
+    try:
+        if not (bag_path / 'bagit.txt').is_file():
+            raise BagValidationError( 'No bagit.txt in %s' % bag_path )
+
+        entries = _read_manifests( bag_path )
+        if not entries:
+            raise BagValidationError( 'No payload manifest in %s' % bag_path )
+
+        payload = {}
+        for root, dirs, files in os.walk( bag_path / 'data' ):
+            for name in files:
+                path = os.path.join( root, name )
+                payload[ os.path.relpath( path, bag_path ).replace( os.sep, '/' ) ] = path
+
+        missing = entries.keys() - payload.keys()
+        if missing:
+            raise BagValidationError( 'Missing payload files %s' % sorted( missing )[:10] )
+
+        extra = payload.keys() - entries.keys()
+        if extra:
+            raise BagValidationError( 'Payload files not in manifest %s' % sorted( extra )[:10] )
+
+        size = sum( os.stat( path ).st_size for path in payload.values() )
+
+        oxum = _read_oxum( bag_path )
+        if oxum and oxum != (size, len(payload)):
+            raise BagValidationError( 'Payload-Oxum %s.%s does not match %s.%s' % (*oxum, size, len(payload)) )
+
+        evt_abort = threading.Event()
+
+        with ThreadPoolExecutor( max_workers=workers ) as executor:
+            futures = [ executor.submit( _hash_file, path, entries[ rel ], chunk_size, evt_abort )
+                        for rel, path in payload.items() ]
+
+            done, pending = wait( futures, return_when=FIRST_EXCEPTION )
+
+            for future in pending:
+                future.cancel()
+
+            for future in done:
+                future.result()
+
+    except (BagValidationError, OSError, ValueError) as e:
+        return report( False, error=str(e) )
+
+    return report( True, len(payload), size, digests=entries )
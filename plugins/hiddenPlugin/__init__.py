@@ -1,3 +1,4 @@
+import asyncio
 import time
 import datetime
 import random
@@ -16,7 +17,8 @@ import ingestorservices.plugin
 
 log_decorator = core.create_logger_decorator( logger )
 
-class HiddenPlugin( ingestorservices.plugin.PluginBase ):
+class HiddenPlugin( ingestorservices.plugin.AsyncPluginBase ):
+    '''Ticks on the host's event loop rather than a thread of its own'''
 
     def on_sig_changed(self, *args, **kwargs ):
         p = args[0]
@@ -26,8 +28,6 @@ class HiddenPlugin( ingestorservices.plugin.PluginBase ):
     def __init__(self, host_svcs):
         super().__init__(host_svcs)
 
-        self.evt_stop = threading.Event()
-
         f1 = properties.Property( 'field1', 'value')
         f2 = properties.Property( 'field2', 'value')
         f3 = properties.Property( 'field3', 'value')
@@ -36,9 +36,11 @@ class HiddenPlugin( ingestorservices.plugin.PluginBase ):
             f.sig_changed.connect( self.on_sig_changed)
             self.properties[ f.name ] = f
 
-    def run(self):
+    async def run(self):
 
-        while not self.evt_stop.wait(timeout=1.0):
+        # stop() cancels the sleep
+        while True:
+            await asyncio.sleep( 1.0 )
 
             s = 'tick - %s' % str(datetime.datetime.now())
 
@@ -53,11 +55,6 @@ class HiddenPlugin( ingestorservices.plugin.PluginBase ):
             p_f1.value = s
 
 
-    def stop(self):
-        self.evt_stop.set()
-        super().stop()
-
-
 class HiddenFactory:
 
     def __call__(self, host_svcs):
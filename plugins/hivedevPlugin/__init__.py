@@ -3,7 +3,8 @@ import fnmatch
 import json
 import logging
 
-from plugins.hivedevPlugin.extract import convert_md_to_json
+from plugins.hivedevPlugin.extract import convert_md_to_tables
+from plugins.hivedevPlugin.reduce import summarise_table, compress_table
 
 logger = logging.getLogger( __name__ )
 
@@ -16,140 +17,37 @@ import ingestorservices.plugin
 log_decorator = core.create_logger_decorator( logger )
 
 import threading
+import time
 import queue
 import pathlib
+import uuid
 
-#import watchdog.observers
-#import watchdog.events
 #from scitacean.testing.docs import setup_fake_client
 #from scitacean import Client, Dataset
 
-class WorkerBase( threading.Thread):
-    '''WorkerBase class serves as a base for other classes and provides a method stop() that notifies any threads waiting on a condition (cond_stop)'''
-    '''that a change has occurred, potentially used to indicate that the thread should stop its execution.'''
-    def __init__(self):
-        super().__init__()
-        self.evt_stop = threading.Event()
-
-    def stop(self):
-        
-            self.evt_stop.set()
-
-
-class RetryWorker( WorkerBase ):
-    '''RetryWorker class periodically checks for bagit files in a specified directory (root) and puts their paths into a queue (q_out)'''
-    '''for further processing, all while waiting for a signal to stop its execution.'''
-    '''Periodically check for bagit files in spool path'''
-
-    def __init__(self, path, q_out):
-
-        super().__init__()
-
-        self.root = path
-        self.q_out = q_out
-
-
-    def run(self):
-            while not self.evt_stop.wait(timeout=1):
-
-                try:
-                   # get the path of the markdown file here - Ajay
-                   paths = self.root.glob( './*/*.md')
-                   for path in sorted(paths):
-                       self.q_out.put( path )
-
-                except Exception as e:
-                    print(e)
-
-
-
-class Producer( WorkerBase ):
-    '''Producer class sets up file system monitoring using RetryWorker and MyHandler, creating workers, observing file system events,'''
-    '''and managing threads to generate trigger events based on detected changes.'''
-    ''' Generate trigger events using the RetryWorker and the MyHandler '''
-
-    def __init__(self, q, path_spool = './data'):
-        super().__init__()
-
-        self.signal = core.Signal()
-        self.count = 0
-        self.q = q
-        self.path_spool = pathlib.Path( path_spool )
-
-    def run(self):
-
-        path =  self.path_spool / 'hive' 
-        path.mkdir( parents=True, exist_ok=True)
-
-        retry_worker = RetryWorker( path, self.q )
-        retry_worker.daemon = True
-        retry_worker.start()
-
-        #evt_handler = MyHandler()
-        
-        #when evt_handler emits a signal, onNewBagit method will be called.
-        #evt_handler.signal.connect( self.onNewBagit )
-
-        #observer = watchdog.observers.Observer()
-
-        #Configures the observer to watch the path directory recursively for events and associates it with evt_handler.
-        #observer.schedule( evt_handler, path, recursive=True )
-
-        #observer.start()
-
-        while not self.evt_stop.wait(timeout=1):
-            pass
-
-        #observer.stop()
-        retry_worker.stop() 
-        retry_worker.join()
-
-    def onNewBagit(self, path):
-        self.q.put( path )
-
-class Consumer( WorkerBase ):
-    '''Consumer class is designed to continuously run in a thread, checking the input queue for data. When data is available in the queue, it emits a signal'''
-    '''(sigDataAvailable) with the retrieved data and proceeds with further tasks if any, continually checking the queue for more data to process.'''
-    
-    '''Recieve event paths '''
-
-    def __init__(self, q_in ):
-
-        super().__init__()
-        self.q_in = q_in
-        self.count = 0
-
-        self.sigDataAvailable = core.Signal()
-
-    def run(self):
-            while not self.evt_stop.wait(timeout=1):
-                                     
-                self.count += 1
-
-                try:
-                    res = self.q_in.get( block=True, timeout=0.2)
-                    
-                    self.sigDataAvailable.emit( res )
-
-                    self.q_in.task_done()
-                except queue.Empty:
-                    pass
-
-
 class HivePlugin( ingestorservices.plugin.PluginBase ):
     '''Wait for events. Extract metadata from placeholder and file before writing to backend '''
 
+    # Pulse tables longer than this are summarised when summarise is 'auto'
+    SUMMARY_ROWS = 1000
+
     def __init__(self, host_services):
         super().__init__(host_services)
         self.path_spool  = pathlib.Path('./data/hive')
-        self.q = queue.Queue()
-        self.producer = Producer(self.q)
-        self.consumer = Consumer( self.q )
-        self.consumer.sigDataAvailable.connect( self.onDataAvailable )
 
-        for t in [self.consumer, self.producer]:
-            #t.daemon = True
-            t.start()
+        self.summarise = 'auto'
+        self.downsample = 0
+        self.pulses = None
+
+        self.path_spool.mkdir( parents=True, exist_ok=True )
+
+        # queued files and form submissions survive a restart of the ingestor
+        self.q = ingestorservices.plugin.DurableQueue( host_services.state_dir( 'queues' ) / '%s.sqlite' % type(self).__name__ )
+        self.consumer = ingestorservices.plugin.Consumer( self.q )
+        self.consumer.sigDataAvailable.connect( self.onWorkItem )
+        self.consumer.start()
+
+        self.subscription = host_services.watcher.subscribe( self.path_spool, '*/*.md', self.q )
 
         print('HIVE1')
 
@@ -213,80 +111,142 @@ class HivePlugin( ingestorservices.plugin.PluginBase ):
 
         print('HIVE6')
 
-    def run(self):
-        print('RUNNNING')
-        for t in [self.consumer, self.producer]:
-            #t.daemon = True
-            t.join()
+    def initialise(self, *args, **kwargs):
+        '''summarise : 'auto', 'yes' or 'no'. downsample : number of points kept per numeric pulse column'''
 
+        self.summarise = str(kwargs.get( 'summarise', self.summarise )).lower()
+        self.downsample = int(kwargs.get( 'downsample', self.downsample ))
 
+    def _summarise_pulses(self, pulses):
+        if self.summarise in ('yes', 'true', '1'):
+            return True
+        if self.summarise == 'auto':
+            return len(pulses) > self.SUMMARY_ROWS
+        return False
+
+    def run(self):
+        print('RUNNNING')
+        self.consumer.join()
 
 
     def stop(self):
-        self.producer.stop()
-        self.consumer.stop()
+        self.host_services.watcher.unsubscribe( self.subscription )
 
-        self.producer.join()
+        self.consumer.stop()
         self.consumer.join()
 
 
+    def drain(self, deadline):
+        self.host_services.watcher.unsubscribe( self.subscription )
+
+        return self.consumer.drain( deadline )
+
     def widget(self):
         return self.w
 
+    def onWorkItem( self, item ):
+        '''Spool files arrive as paths, submissions from the UI as dicts'''
+
+        if isinstance( item, dict ):
+            self.submit( item )
+        else:
+            self.onDataAvailable( item )
+
     def onDataAvailable( self, *args ):
         filePath = pathlib.Path( args[0] )
 
         if filePath.exists():
-            jsonFileRaw = convert_md_to_json(filePath.read_text())
-            jsonFileDict = json.loads(jsonFileRaw)
+            sections = convert_md_to_tables(filePath.read_text())
+            testingLog = sections['HIVE testing log']
+
+            operator = testingLog['Operators'][0].split(',')[0].strip()
 
             propOwner = self.properties[ 'Owner' ]
-            propOwner.value = jsonFileDict['HIVE testing log'][0]['Operators'][0]
+            propOwner.value = operator
 
             propOwnerGroup = self.properties[ 'Owner group' ]
             propOwnerGroup.value = 'HIVE'
 
             propPrincipleInvestigator = self.properties[ 'Principal Investigator' ]
-            propPrincipleInvestigator.value = jsonFileDict['HIVE testing log'][0]['Operators'][0]
+            propPrincipleInvestigator.value = operator
 
             propEmail = self.properties[ 'Contact email' ]
             propEmail.value = propOwner.value.replace(" ", "").lower() + '@ukaea.uk'
 
             propSourceFolder = self.properties[ 'Data source' ]
-            propSourceFolder.value = jsonFileDict['HIVE testing log'][0]['Sample Name']
+            propSourceFolder.value = str(testingLog['Sample Name'][0])
 
             propDate = self.properties[ 'Date' ]
-            propDateStr = jsonFileDict['HIVE testing log'][0]['Date']
-            propDate.value = datetime.datetime.strptime(propDateStr, '%Y%m%d').date().strftime('%d/%m/%Y')
+            propDate.value = testingLog['Date'][0].item().strftime('%d/%m/%Y')
 
             propLocation = self.properties[ 'Location' ]
             propLocation.value = 'FTF'
 
-            propExperimentData = self.properties[ 'Experiment data' ]
+            pulses = sections['Pulses']
+
             combined_data = {
-                'Summary': jsonFileDict['Summary'],
-                'Pulses': jsonFileDict['Pulses'],
-                'Issues': jsonFileDict['Issues']
+                'Summary': sections['Summary'],
+                'Issues': sections['Issues']
             }
 
+            # Large pulse tables are reduced to per column statistics. The full
+            # table is uploaded as a compressed attachment on submit
+            if self._summarise_pulses( pulses ):
+                combined_data['Pulses summary'] = summarise_table( pulses, downsample=self.downsample )
+                self.pulses = pulses
+            else:
+                combined_data['Pulses'] = pulses.to_records()
+                self.pulses = None
+
             combined_json_string = json.dumps(combined_data, indent=2)
             propExperimentData = self.properties['Experiment data']
             propExperimentData.value = combined_json_string
 
     def onSubmitRequest(self):
-        dataSet = Dataset(
+        '''Capture the form now and upload from the consumer thread, ahead of any spool backlog'''
+
+        ownable = metadata.Ownable( ownerGroup=self.properties['Owner group'].value )
+
+        dataset = metadata.Dataset(
             owner=self.properties['Owner'].value,
-            owner_group=self.properties['Owner group'].value,
-            principal_investigator=self.properties['Principal Investigator'].value,
-            contact_email=self.properties['Contact email'].value,
-            source_folder=self.properties['Data source'].value,
-            creation_time=self.properties['Date'].value,
-            creation_location=self.properties['Location'].value,
-            meta=json.loads(self.properties['Experiment data'].value),
-            type="raw"
-        )
-
-        print(dataSet)
+            principalInvestigator=self.properties['Principal Investigator'].value,
+            contactEmail=self.properties['Contact email'].value,
+            sourceFolder=self.properties['Data source'].value,
+            creationTime=self.properties['Date'].value,
+            creationLocation=self.properties['Location'].value,
+            scientificMetadata=json.loads(self.properties['Experiment data'].value),
+            type="raw",
+            **ownable.dict() )
+
+        submission = {
+            'key' : str(uuid.uuid4()),
+            'dataset' : dataset.dict(),
+            'pulses' : compress_table( self.pulses ) if self.pulses is not None else None,
+        }
+
+        try:
+            self.q.put( submission, timeout=5, priority=ingestorservices.plugin.Priority.INTERACTIVE, key=submission['key'] )
+        except queue.Full:
+            self.log( 'Submit failed : work queue full %s' % self.q.metrics() )
+
+    def submit(self, submission):
+        host_services = self.host_services
+
+        dataset = metadata.Dataset( **submission['dataset'] )
+
+        dataset_id = host_services.requestDatasetSave( dataset, key=submission['key'] ).result()
+
+        if not dataset_id:
+            raise RuntimeError( 'Dataset save failed for %s' % dataset.sourceFolder )
+
+        if submission['pulses'] is not None:
+            attachment = metadata.Attachment(
+                datasetId=dataset_id,
+                thumbnail=submission['pulses'],
+                caption='Pulses',
+                ownerGroup=dataset.ownerGroup )
+
+            host_services.requestAttachmentSave( attachment ).result()
 
 class Factory:
 
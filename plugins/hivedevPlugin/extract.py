@@ -1,61 +1,174 @@
+import datetime
 import json
 import re
 
-# Function to convert Markdown content to JSON
-def convert_md_to_json(markdown_text):
+import numpy as np
+
+# Markdown table separator row e.g. |---|:---:|
+_SEPARATOR_ROW = re.compile(r'^[\s|:]*-[\s|:-]*$')
+
+# Date formats tried during column type inference. The compact form is only
+# tried for columns whose header mentions a date, otherwise it is an int
+_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+_COMPACT_DATE_FORMAT = '%Y%m%d'
+
+# Numbers written with leading zeros, e.g. 0012, are identifiers and kept as
+# text, as are columns whose header names an id
+_LEADING_ZERO = re.compile(r'^[+-]?0\d')
+_ID_HEADER = re.compile(r'(^|[\s_])id$', re.IGNORECASE)
+
+
+# Split markdown into (title, content) pairs based on headings
+def _iter_sections(markdown_text):
 
-    # Split the Markdown content into sections based on headings
     sections = re.split(r'#+\s+', markdown_text)
-    # Initialize the JSON structure
-    json_data = {}
 
-    # Process each section seperately
     for section in sections[1:]:
         section_lines = section.strip().split('\n')
 
         # Remove ° character from section lines
         section_lines = [line.replace('°', '') for line in section_lines]
 
-        section_title = section_lines[0]
-        section_content = '\n'.join(section_lines[1:])
-        
-        # If section content contains a table (identified by '|'), convert it to JSON
+        yield section_lines[0], '\n'.join(section_lines[1:])
+
+
+# Function to convert Markdown content to JSON
+def convert_md_to_json(markdown_text):
+    '''JSON string of convert_md_to_tables, tables as lists of row dicts.'''
+    '''Cells are typed as in the tables: numbers, dates as ISO strings and None for empty cells, where this'''
+    '''function used to give every cell as it was written. Ids and numbers with leading zeros stay strings'''
+
+    sections = convert_md_to_tables(markdown_text)
+
+    json_data = { title : (section.to_records() if isinstance(section, Table) else section)
+                  for title, section in sections.items() }
+
+    return json.dumps(json_data, indent=2, ensure_ascii=False)
+
+
+def _parse_dates(cells, formats):
+    for fmt in formats:
+        try:
+            return [ datetime.datetime.strptime(c, fmt).date() if c else None for c in cells ]
+        except ValueError:
+            pass
+
+    return None
+
+
+def _infer_column(name, cells):
+    '''Convert a list of cell strings ('' for empty) to a typed NumPy array.'''
+    '''Tries date, int, float and falls back to str. Empty cells become NaN/NaT/'' '''
+    '''Id columns and columns with a number written with leading zeros stay str'''
+
+    missing = np.array([ not c for c in cells ], dtype=bool)
+
+    if missing.all():
+        return np.array(cells, dtype=str)
+
+    formats = _DATE_FORMATS
+    if 'date' in name.lower():
+        formats = formats + (_COMPACT_DATE_FORMAT,)
+
+    dates = _parse_dates(cells, formats)
+    if dates is not None:
+        return np.array([ d if d else 'NaT' for d in dates ], dtype='datetime64[D]')
+
+    raw = np.array(cells, dtype=str)
+    present = raw[~missing]
+
+    if _ID_HEADER.search(name.strip()) or any( _LEADING_ZERO.match(c) for c in cells ):
+        return raw
+
+    if not missing.any():
+        try:
+            return present.astype(np.int64)
+        except ValueError:
+            pass
+
+    try:
+        values = np.full(len(cells), np.nan)
+        values[~missing] = present.astype(np.float64)
+        return values
+    except ValueError:
+        pass
+
+    return raw
+
+
+class Table:
+    '''Column oriented markdown table. Each column is a typed NumPy array of equal length'''
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def from_markdown(cls, section_content):
+        rows = [ row for row in section_content.strip().split('\n') if row.strip() ]
+        keys = [ cell.strip() for cell in rows[0].split('|')[1:-1] ]
+
+        cells = [ [] for key in keys ]
+
+        for row in rows[1:]:
+            if _SEPARATOR_ROW.match(row.strip()):
+                continue
+
+            values = [ cell.strip() for cell in row.split('|')[1:-1] ]
+
+            for i, column in enumerate(cells):
+                column.append( values[i] if i < len(values) else '' )
+
+        return cls({ key : _infer_column(key, column) for key, column in zip(keys, cells) })
+
+    def __len__(self):
+        for column in self.columns.values():
+            return len(column)
+        return 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def keys(self):
+        return self.columns.keys()
+
+    @property
+    def nbytes(self):
+        return sum( column.nbytes for column in self.columns.values() )
+
+    def to_records(self):
+        '''Row oriented list of dicts of plain python values'''
+
+        columns = {}
+        for key, column in self.columns.items():
+
+            if column.dtype.kind == 'M':
+                values = [ None if np.isnat(v) else v.item().isoformat() for v in column ]
+            elif column.dtype.kind == 'f':
+                values = [ None if v != v else v for v in column.tolist() ]
+            elif column.dtype.kind == 'U':
+                values = [ ([ v.strip() for v in s.split(',') ] if ',' in s else s) or None for s in column.tolist() ]
+            else:
+                values = column.tolist()
+
+            columns[key] = values
+
+        return [ dict(zip(columns.keys(), row)) for row in zip(*columns.values()) ]
+
+
+# Function to convert Markdown content to typed columnar tables
+def convert_md_to_tables(markdown_text):
+    '''Table sections are returned as Table instances, other sections as text'''
+
+    sections = {}
+
+    for section_title, section_content in _iter_sections(markdown_text):
+
         if '|' in section_content:
-            table_data = []
-            rows = section_content.strip().split('\n')
-            header = rows[0]
-            keys = [cell.strip() for cell in header.split('|')[1:-1]]
-            
-            # Extract table rows and convert them into JSON format
-            for row in rows[1:]:
-                values = [cell.strip() for cell in row.split('|')[1:-1]]
-                
-                row_data = {}
-                for i, key in enumerate(keys):
-                    if i < len(values):  # Check if 'values' list has enough elements
-                        if ',' in values[i]:
-                            values[i] = [v.strip() for v in values[i].split(',')]
-                        row_data[key] = values[i]
-                    else:
-                        row_data[key] = None  # Assign None if value is missing
-                table_data.append(row_data)
-
-            # Exclude the first row from specific sections
-            if section_title == "HIVE testing log" or section_title == "Pulses":  # Fix conditional check
-                # Exclude the first row from HIVE testing log
-                table_data = table_data[1:]
-
-            json_data[section_title] = table_data
-        
-        # If section content contains line breaks but no tables, replace line breaks with spaces
-        elif '\n' in section_content:
-            section_content  = section_content.replace('\n', ' ')  
-            json_data[section_title] = section_content 
+            sections[section_title] = Table.from_markdown(section_content)
         else:
-            json_data[section_title] = section_content
-             
-    # Convert JSON data to a formatted JSON string
-    json_str = json.dumps(json_data, indent=2, ensure_ascii=False)
+            sections[section_title] = section_content.replace('\n', ' ')
 
-    # Display the JSON string on the console
-    return json_str
\ No newline at end of file
+    return sections
@@ -0,0 +1,78 @@
+import base64
+import gzip
+import json
+
+import numpy as np
+
+
+def _downsample(values, points):
+    '''Mean of `points` equal width buckets, ignoring NaN'''
+
+    if len(values) <= points:
+        return values
+
+    starts = np.linspace(0, len(values), points + 1).astype(np.int64)[:-1]
+
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+    counts = np.add.reduceat(valid.astype(np.int64), starts)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def summarise_column(column, downsample=0):
+    '''Reduce a typed column to count/min/max(/mean) and optionally a downsampled series'''
+
+    kind = column.dtype.kind
+
+    if kind in 'if':
+        values = column.astype(np.float64)
+        valid = values[~np.isnan(values)]
+
+        summary = { 'count' : int(valid.size) }
+
+        if valid.size:
+            # int columns have no NaN so keep their min/max as ints
+            extrema = column if kind == 'i' else valid
+
+            summary['min'] = extrema.min().item()
+            summary['max'] = extrema.max().item()
+            summary['mean'] = valid.mean().item()
+
+        if downsample:
+            series = _downsample(values, downsample)
+            summary['series'] = [ None if v != v else v for v in series.tolist() ]
+
+    elif kind == 'M':
+        valid = column[~np.isnat(column)]
+
+        summary = { 'count' : int(valid.size) }
+
+        if valid.size:
+            summary['min'] = valid.min().item().isoformat()
+            summary['max'] = valid.max().item().isoformat()
+
+    else:
+        valid = column[column != '']
+
+        summary = { 'count' : int(valid.size), 'unique' : int(np.unique(valid).size) }
+
+    return summary
+
+
+def summarise_table(table, downsample=0):
+    summary = { 'rows' : len(table), 'columns' : {} }
+
+    for key in table.keys():
+        summary['columns'][key] = summarise_column(table[key], downsample=downsample)
+
+    return summary
+
+
+def compress_table(table):
+    '''gzip JSON records of the table as a base64 data URI, suitable for an Attachment thumbnail'''
+
+    raw = json.dumps(table.to_records(), ensure_ascii=False).encode('utf-8')
+
+    return 'data:application/gzip;base64,' + base64.b64encode(gzip.compress(raw)).decode('ascii')
@@ -17,165 +17,29 @@ import ingestorservices.plugin
 log_decorator = core.create_logger_decorator( logger )
 
 import threading
+import time
 import queue
 import pathlib
 
-import watchdog.observers
-import watchdog.events
-
-class WorkerBase( threading.Thread):
-    '''WorkerBase class serves as a base for other classes and provides a method stop() that notifies any threads waiting on a condition (cond_stop)'''
-    '''that a change has occurred, potentially used to indicate that the thread should stop its execution.'''
-    def __init__(self):
-        super().__init__()
-        self.cond_stop = threading.Condition()
-
-    def stop(self):
-        
-        with self.cond_stop:
-            self.cond_stop.notify()
-
-
-class RetryWorker( WorkerBase ):
-    '''RetryWorker class periodically checks for bagit files in a specified directory (root) and puts their paths into a queue (q_out)'''
-    '''for further processing, all while waiting for a signal to stop its execution.'''
-    '''Periodically check for bagit files in spool path'''
-
-    def __init__(self, path, q_out):
-
-        super().__init__()
-
-        self.root = path
-        self.q_out = q_out
-
-
-    def run(self):
-        with self.cond_stop:
-            while not self.cond_stop.wait(timeout=1):
-
-                try:
-                   # get the path of the markdown file here - Ajay
-                   paths = self.root.glob( './*/*.out')
-                   for path in sorted(paths):
-                       self.q_out.put( path )
-
-                except Exception as e:
-                    print(e)
-
-
-class MyHandler( watchdog.events.FileSystemEventHandler ):
-    '''MyHandler class is designed to handle file system events and specifically watches for the creation of files.'''
-    '''When a new bagit.txt file is created and the specified conditions are met, it emits a signal with the file's path.'''
-    '''Watch for creation of bagit files using FileSystemEvents'''
-
-    signal = core.Signal()
-    def __init__(self, *args, **kwargs ):
-        super().__init__( *args, **kwargs )
-        self.last_created = None
-        self.last_time = datetime.datetime.min
-
-    def on_any_event(self, evt):
-        path = pathlib.Path(evt.src_path)
-        dt = datetime.timedelta(milliseconds=500)
-
-        if evt.event_type == 'created':
-                if fnmatch.fnmatch(path.name, '*.out'):
-                    if path != self.last_created and datetime.datetime.now() - self.last_time > dt:
-                        self.last_created = path
-                        self.last_time = datetime.datetime.now()
-
-                        self.signal.emit( evt.src_path )
-
-
-class Producer( WorkerBase ):
-    '''Producer class sets up file system monitoring using RetryWorker and MyHandler, creating workers, observing file system events,'''
-    '''and managing threads to generate trigger events based on detected changes.'''
-    ''' Generate trigger events using the RetryWorker and the MyHandler '''
-
-    def __init__(self, q, path_spool = './data'):
-        super().__init__()
-
-        self.signal = core.Signal()
-        self.count = 0
-        self.q = q
-        self.path_spool = pathlib.Path( path_spool )
-
-    def run(self):
-
-        path =  self.path_spool / 'pegasus' 
-        path.mkdir( parents=True, exist_ok=True)
-
-        retry_worker = RetryWorker( path, self.q )
-        retry_worker.daemon = True
-        retry_worker.start()
-
-        evt_handler = MyHandler()
-        
-        #when evt_handler emits a signal, onNewBagit method will be called.
-        evt_handler.signal.connect( self.onNewBagit )
-
-        observer = watchdog.observers.Observer()
-
-        #Configures the observer to watch the path directory recursively for events and associates it with evt_handler.
-        observer.schedule( evt_handler, path, recursive=True )
-
-        observer.start()
-
-        with self.cond_stop:
-            while not self.cond_stop.wait(timeout=1):
-                pass
-
-        observer.stop()
-        retry_worker.stop() 
-        retry_worker.join()
-
-    def onNewBagit(self, path):
-        self.q.put( path )
-
-class Consumer( WorkerBase ):
-    '''Consumer class is designed to continuously run in a thread, checking the input queue for data. When data is available in the queue, it emits a signal'''
-    '''(sigDataAvailable) with the retrieved data and proceeds with further tasks if any, continually checking the queue for more data to process.'''
-    
-    '''Recieve event paths '''
-
-    def __init__(self, q_in ):
-
-        super().__init__()
-        self.q_in = q_in
-        self.count = 0
-
-        self.sigDataAvailable = core.Signal()
-
-    def run(self):
-        with self.cond_stop:
-            while not self.cond_stop.wait(timeout=1):
-                                     
-                self.count += 1
-
-                try:
-                    res = self.q_in.get( block=True, timeout=0.2)
-                    
-                    self.sigDataAvailable.emit( res )
-
-                    self.q_in.task_done()
-                except queue.Empty:
-                    pass
-
-
 class PegasusPlugin( ingestorservices.plugin.PluginBase ):
     '''Wait for events. Extract metadata from placeholder and file before writing to backend '''
 
+    # seconds an output file must be unchanged before it is extracted
+    SETTLE = 5.0
+
     def __init__(self, host_services):
         super().__init__(host_services)
         self.path_spool  = pathlib.Path('./data/pegasus')
-        self.q = queue.Queue()
-        self.producer = Producer(self.q)
-        self.consumer = Consumer( self.q )
+        self.path_spool.mkdir( parents=True, exist_ok=True )
+
+        # queued output files survive a restart of the ingestor
+        self.q = ingestorservices.plugin.DurableQueue( host_services.state_dir( 'queues' ) / '%s.sqlite' % type(self).__name__ )
+        self.consumer = ingestorservices.plugin.Consumer( self.q, daemon=True )
         self.consumer.sigDataAvailable.connect( self.onDataAvailable )
+        self.consumer.start()
 
-        for t in [self.consumer, self.producer]:
-            t.daemon = True
-            t.start()
+        # ANSYS writes its .out files over the whole run, so only hand them on once complete
+        self.subscription = host_services.watcher.subscribe( self.path_spool, '*/*.out', self.q, settle=self.SETTLE )
 
         def requireProperty( name, value ):
 
@@ -235,13 +99,17 @@ class PegasusPlugin( ingestorservices.plugin.PluginBase ):
 
 
     def finish(self):
-        self.producer.stop()
-        self.consumer.stop()
+        self.host_services.watcher.unsubscribe( self.subscription )
 
-        self.producer.join()
+        self.consumer.stop()
         self.consumer.join()
 
 
+    def drain(self, deadline):
+        self.host_services.watcher.unsubscribe( self.subscription )
+
+        return self.consumer.drain( deadline )
+
     def widget(self):
         return self.w
 
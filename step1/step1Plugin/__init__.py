@@ -16,6 +16,7 @@ import ingestorservices.properties as properties
 import ingestorservices.core as core
 import ingestorservices.metadata as metadata
 import ingestorservices.plugin
+import ingestorservices.workflow as workflow
 
 log_decorator = core.create_logger_decorator( logger )
 
@@ -32,6 +33,9 @@ class Step1Plugin( ingestorservices.plugin.PluginBase ):
 
         self.evt_stop = threading.Event()
 
+        # results handed to later steps of the same run
+        self.artifacts = workflow.ArtifactStore( host_svcs.state_dir( 'artifacts' ) )
+
         f1 = properties.Property( 'field1', 'value')
         f2 = properties.Property( 'field2', 'value')
         f3 = properties.Property( 'field3', 'value')
@@ -67,14 +71,6 @@ class Step1Plugin( ingestorservices.plugin.PluginBase ):
 
         #write the metadata
         # Create an Ownable that will get reused for several other Model objects
-        ownable = metadata.Ownable(ownerGroup="magrathea"
-                                   , accessGroups=["deep_though"]
-                                   , createdBy=None
-                                   , updatedBy=None
-                                   , updatedAt=None
-                                   , createdAt=None
-                                   , instrumentGroup=None)
-
         ownable = metadata.Ownable(ownerGroup="magrathea"
                                    , accessGroups=["deep_though"] )
 
@@ -105,12 +101,18 @@ class Step1Plugin( ingestorservices.plugin.PluginBase ):
             **ownable.dict(), )
 
         with open( self.output_fname, 'w') as f:
-            json.dump( dataset.dict(), f )
+            metadata.write_json( dataset, f )
 
-        dataset_id = host_services.requestDatasetSave( dataset )
+        dataset_id = host_services.requestDatasetSave( dataset ).result()
         self.log( 'STEP1 DS ID %s' % dataset_id)
         #result = host_services.requestDatasetFind( {'pid' : dataset_id} )
 
+        if dataset_id:
+            self.artifacts.publish( self.runId, 'step1', dataset_id, dataset.dict() )
+
+        # handed to dependent steps when run by a workflow
+        return workflow.StepResult( dataset_id, dataset.dict() )
+
     def stop(self):
         self.evt_stop.set()
 
@@ -15,6 +15,7 @@ import ingestorservices.properties as properties
 import ingestorservices.core as core
 import ingestorservices.metadata as metadata
 import ingestorservices.plugin
+import ingestorservices.workflow as workflow
 
 log_decorator = core.create_logger_decorator( logger )
 
@@ -31,6 +32,9 @@ class Step2Plugin( ingestorservices.plugin.PluginBase ):
 
         self.evt_stop = threading.Event()
 
+        # results handed to later steps of the same run
+        self.artifacts = workflow.ArtifactStore( host_svcs.state_dir( 'artifacts' ) )
+
         f1 = properties.Property( 'field1', 'value')
         f2 = properties.Property( 'field2', 'value')
         f3 = properties.Property( 'field3', 'value')
@@ -44,6 +48,42 @@ class Step2Plugin( ingestorservices.plugin.PluginBase ):
         self.runId = kwargs['run']
         self.output_fname = kwargs.get(  'outputfile', '/tmp/run1.json' )
 
+        # results of the steps this one depends on, when run by a workflow
+        self.upstream = kwargs.get( 'upstream', {} )
+
+        # seconds to wait for step1's dataset to appear in the catalog
+        self.wait = float( kwargs.get( 'wait', 60 ) )
+        self.watch = None
+
+    def _find_step1(self):
+        '''The step1 dataset of this run, from the workflow or the artifact store when possible, otherwise the latest in the catalog.'''
+        '''If there is none yet, waits up to self.wait seconds for one to appear'''
+
+        step1 = self.upstream.get( 'step1' ) or self.artifacts.get( self.runId, 'step1' )
+
+        if step1 is not None and step1.dataset is not None:
+            return { **step1.dataset, 'pid' : step1.pid }
+
+        prev_results = self.host_services.requestDatasetFind( {'scientificMetadata.step' : 1, 'scientificMetadata.run' : self.runId} )
+
+        if prev_results:
+
+            def f( ds ):
+                val = ds['creationTime']
+                return val
+
+            _ = sorted( prev_results, key = f )
+
+            return _[-1]
+
+        self.log( 'Waiting for step1 of run %s' % self.runId )
+
+        self.watch = self.host_services.watch( {'scientificMetadata.step' : 1, 'scientificMetadata.run' : self.runId}, timeout=self.wait )
+
+        for ds in self.watch:
+            self.watch.stop()
+            return ds
+
     def run(self):
 
         timeout=0.1
@@ -74,30 +114,14 @@ class Step2Plugin( ingestorservices.plugin.PluginBase ):
 
         #write the metadata
         # Create an Ownable that will get reused for several other Model objects
-        ownable = metadata.Ownable(ownerGroup="magrathea"
-                                   , accessGroups=["deep_though"]
-                                   , createdBy=None
-                                   , updatedBy=None
-                                   , updatedAt=None
-                                   , createdAt=None
-                                   , instrumentGroup=None)
-
         ownable = metadata.Ownable(ownerGroup="magrathea"
                                    , accessGroups=["deep_though"] )
 
         host_services = self.host_services
 
-        prev_results = host_services.requestDatasetFind( {'scientificMetadata.step' : 1} )
-
-        if prev_results:
-
-            def f( ds ):
-                val = ds['creationTime']
-                return val
-
-            _ = sorted( prev_results, key = f )
+        ds_step1 = self._find_step1()
 
-            ds_step1 = _[-1]
+        if ds_step1:
 
             self.log('FOUND PREV STEP1 %s' %  ds_step1['pid'] )
 
@@ -132,14 +156,22 @@ class Step2Plugin( ingestorservices.plugin.PluginBase ):
                 **ownable.dict(), )
 
             with open( self.output_fname, 'w') as f:
-                json.dump( dataset.dict(), f )
+                metadata.write_json( dataset, f )
+
+            dataset_id = host_services.requestDatasetSave( dataset ).result()
 
-            dataset_id = host_services.requestDatasetSave( dataset )
+            if dataset_id:
+                self.artifacts.publish( self.runId, 'step2', dataset_id, dataset.dict() )
+
+            return workflow.StepResult( dataset_id, dataset.dict() )
 
 
     def stop(self):
         self.evt_stop.set()
 
+        if self.watch is not None:
+            self.watch.stop()
+
 class Factory:
 
     def __call__(self, host_svcs):
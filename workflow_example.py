@@ -0,0 +1,40 @@
+import  argparse
+import requests
+
+import ingestorservices
+import ingestorservices.workflow as workflow
+
+from cli_example import keyvalue
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                            prog='WorkflowRunner',
+                            description='Runs the step plugins as one workflow')
+
+    parser.add_argument('--kwargs',  nargs='*', action = keyvalue, default={})
+
+    args = parser.parse_args()
+
+    url='http://localhost/api/v3'
+    uid='ingestor'
+    password='aman'
+
+    try:
+        host_services = ingestorservices.HostServices()
+        host_services.bridge.signalLog.connect( print )
+        host_services.login( url, uid, password )
+    except requests.exceptions.ConnectionError as e:
+        print('Failed to login')
+        print(e)
+    except Exception as e:
+        print(type(e), e)
+
+    wf = workflow.Workflow( host_services )
+    wf.add( 'step1', 'step1', plugin='step1Plugin' )
+    wf.add( 'step2', 'step2', plugin='step2Plugin', depends=['step1'] )
+
+    results = wf.run( **args.kwargs )
+
+    for name, result in results.items():
+        host_services.log( '%s : %s' % (name, result) )
@@ -2,17 +2,8 @@
 
 RUN=1
 
-echo STEP 1 START
-python cli_example.py step1 --kwargs run=$RUN
+# step2 depends on step1, both run in one process
+echo WORKFLOW START
+python workflow_example.py --kwargs run=$RUN
 
-echo STEP 1 FINISHED
-#exit 0
-
-echo
-
-echo STEP 2 START
-
-
-python cli_example.py step2 --kwargs run=$RUN
-
-echo STEP 2 FINISHED
+echo WORKFLOW FINISHED